@@ -0,0 +1,281 @@
+#! /usr/bin/env python
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import csv
+import json
+import logging
+import math
+import multiprocessing
+import optparse
+import random
+import time
+
+from hydronic import BTU_ft3_F, C_to_F
+from network import network
+
+import simulator
+
+#
+# Model calibration.  Fits the building's R values and material heat capacities (BTU_ft3_F) to
+# recorded sensor history, by replaying the history through the lumped (RC network) model of the
+# building, and minimizing the RMS error between the computed and measured temperatures.
+#
+#     The history is a CSV file; a 'time' column (in seconds), then a column per sensor named for
+# its space (eg. 'left', 'slab 1', 'zone 2'; in degrees C, blank if unavailable), and the heat
+# delivered to each zone's water, as '<zone> BTU/h' (eg. 'zone 1 BTU/h').  The 'world' and 'ground'
+# columns are the outdoor and soil temperatures, and drive the model; every other sensor is compared
+# with the model's computed temperature.  The history is resampled once to the model's step.
+#
+#     The optimizer is the cross-entropy method; each iteration samples a population of candidate
+# parameter sets (log-normally distributed around the current estimate), replays the history with
+# each (in parallel, one replay per process), and re-estimates the distribution from the best
+# (elite) fraction of the candidates.  Each parameter is a multiple of its hand estimate.
+#
+#     The result is a calibrated building file (JSON) of the fitted R and BTU_ft3_F values, which
+# simulator.py -b/--building <file> applies before building its model.  Note that the values are
+# fitted to the RC network model (see network.py), which is what steps a headless campus (-n) or
+# adaptive (-a) simulation; so they apply exactly there.  The site stepped by the hydronic model
+# (the UI, or a plain headless simulation) uses the same R and BTU_ft3_F values, but computes its
+# portals' heat flows and surface temperatures in more detail (eg. its films and subspaces), so its
+# error may be somewhat larger than the fitted RMS error.
+#
+def history( path, step ):
+    # Load and resample the CSV history at 'step' second intervals.  Returns the sample times, and a
+    # { column: [value or None,...] } of each column's linearly interpolated values.  Raises
+    # ValueError if the history is empty, or has no 'time' column, or no samples.
+    with open( path ) as f:
+        reader			= csv.DictReader( f )
+        rows			= list( reader )
+        if not reader.fieldnames:
+            raise ValueError( "History %s is empty" % path )
+        if 'time' not in reader.fieldnames:
+            raise ValueError( "History %s has no 'time' column" % path )
+    if not rows:
+        raise ValueError( "History %s has no samples" % path )
+    rows.sort( key=lambda row: float( row['time'] ))
+    first, last			= float( rows[0]['time'] ), float( rows[-1]['time'] )
+    times			= [ first + k * step for k in range( int( ( last - first ) // step ) + 1 ) ]
+    series			= {}
+    for col in rows[0].keys():
+        if col == 'time':
+            continue
+        samples			= [ ( float( row['time'] ), float( row[col] ))
+                                    for row in rows if row.get( col ) not in ( None, '' ) ]
+        values			= []
+        j			= 0
+        for t in times:
+            while j + 1 < len( samples ) and samples[j+1][0] <= t:
+                j	       += 1
+            if not samples or t < samples[0][0] or t > samples[-1][0]:
+                values.append( None )
+            elif j + 1 < len( samples ) and samples[j][0] < t:
+                ( t0, v0 ), ( t1, v1 ) = samples[j], samples[j+1]
+                values.append( v0 + ( v1 - v0 ) * ( t - t0 ) / ( t1 - t0 ))
+            else:
+                values.append( samples[j][1] )
+        series[col]		= values
+    return times, series
+
+
+class replay( object ):
+    # A site's RC network, and the history to replay through it.  The network's topology is fixed;
+    # each evaluation just recomputes its C and UA from a candidate's R and BTU_ft3_F values.
+    def __init__( self, site, times, series, step, warmup = 6 * 60 * 60 ):
+        self.step		= step
+        self.warmup		= int( warmup // step )
+        self.net		= net = network()
+        net.add( site.spaces )
+        portals			= dict( ( ( n, p.name ), p ) for n,sp in site.spaces.items() for p in sp.portals )
+
+        # Each edge's area, and its R and film; either the name of an R value, or a fixed value
+        self.edges		= []
+        for e,key in enumerate( net.keys ):
+            p			= portals[key]
+            r, film		= site.kinds.get( key, ( None, None ))
+            self.edges.append( ( p.area(), r or p.R, film or getattr( p, 'film', 0 ) or 0 ))
+        # Each free node's volume and material
+        self.nodes		= []
+        for i,n in enumerate( net.names ):
+            if not net.fixed[i]:
+                sp		= site.spaces[n]
+                w, l, h		= sp.size[:3]
+                self.nodes.append( ( i, w * l * h, sp.conditions.what ))
+
+        # The fixed boundary inputs, heat inputs, and measured free node temperatures (all in F)
+        def degrees( values ):
+            return [ None if v is None else C_to_F( v ) for v in values ]
+        self.inputs		= [ ( net.index[n], degrees( series[n] )) for n in ( 'world', 'ground' )
+                                    if n in series ]
+        self.heat		= [ ( net.index[c[:-len( ' BTU/h' )]], [ v or 0. for v in series[c] ] )
+                                    for c in sorted( series ) if c.endswith( ' BTU/h' )
+                                    and c[:-len( ' BTU/h' )] in net.index ]
+        self.measured		= [ ( net.index[n], degrees( series[n] )) for n in sorted( series )
+                                    if n in net.index and not net.fixed[net.index[n]] ]
+        self.count		= len( times )
+        initial			= [ v[0] for _,v in self.measured if v[0] is not None ]
+        self.initial		= sum( initial ) / len( initial ) if initial else simulator.temp['']
+        if not self.measured:
+            raise ValueError( "History has no sensors matching any of the model's spaces" )
+
+    def parameters( self ):
+        # The { 'R:<name>': value, 'BTU_ft3_F:<what>': value, ... } the model depends on
+        params			= {}
+        for _,r,film in self.edges:
+            for k in ( r, film ):
+                if not isinstance( k, ( int, float )):
+                    params['R:' + k] = simulator.R[k]
+        for _,_,what in self.nodes:
+            params['BTU_ft3_F:' + what] = BTU_ft3_F[what]
+        return params
+
+    def evaluate( self, params ):
+        # Replay the history with the given parameters; returns the RMS error (F) after warmup.
+        def value( k ):
+            return k if isinstance( k, ( int, float )) else params.get( 'R:' + k, simulator.R[k] )
+        net			= self.net
+        for e,( a, r, film ) in enumerate( self.edges ):
+            net.UA[e]		= a / max( value( r ) + value( film ), 1e-6 )
+        for i,vol,what in self.nodes:
+            net.C[i]		= vol * params.get( 'BTU_ft3_F:' + what, BTU_ft3_F[what] )
+        net.changed()
+        T, Q			= net.T, net.Q
+        for i,_,_ in self.nodes:
+            T[i]		= self.initial
+        for i,v in self.measured:
+            if v[0] is not None:
+                T[i]		= v[0]
+        sse, n			= 0., 0
+        for k in range( 1, self.count ):
+            for i,v in self.inputs:
+                if v[k] is not None:
+                    T[i]	= v[k]
+            for i,v in self.heat:
+                Q[i]		= v[k]
+            net.step( self.step )
+            if k < self.warmup:
+                continue
+            for i,v in self.measured:
+                if v[k] is not None:
+                    sse	       += ( T[i] - v[k] ) ** 2
+                    n	       += 1
+        return math.sqrt( sse / n ) if n else float( 'inf' )
+
+
+# The replay of each (worker) process, and its evaluation function (for multiprocessing.Pool)
+model				= None
+
+def initialize( rep ):
+    global model
+    model			= rep
+
+def evaluate( params ):
+    return model.evaluate( params )
+
+
+def optimize( base, population = 48, iterations = 25, elite = .2, spread = 2., pool = None,
+              tolerance = .01, evaluate = evaluate ):
+    # Cross-entropy minimization of evaluate( params ) in log-parameter space, starting from base.
+    # Each parameter is kept within a factor of 10 of its base value.  Returns ( rms, params ).  Any
+    # other (module level, if a pool is used) evaluate function returning an RMS error (F) may be used.
+    names			= sorted( base )
+    mu				= [ math.log( base[n] ) for n in names ]
+    sd				= [ math.log( spread ) ] * len( names )
+    lo				= [ m - math.log( 10 ) for m in mu ]
+    hi				= [ m + math.log( 10 ) for m in mu ]
+    keep			= max( 2, int( population * elite ))
+    mapper			= pool.map if pool else map
+    best			= ( evaluate( base ), dict( base ))
+    logging.info( "Initial: RMS error % 7.3fC" % ( best[0] * 5 / 9 ))
+    for it in range( iterations ):
+        logs			= [ mu ] + [ [ min( h, max( l, random.gauss( m, s )))
+                                               for m,s,l,h in zip( mu, sd, lo, hi ) ]
+                                             for _ in range( population - 1 ) ]
+        cands			= [ dict( zip( names, map( math.exp, x ))) for x in logs ]
+        ranked			= sorted( zip( mapper( evaluate, cands ), range( population )))
+        if ranked[0][0] < best[0]:
+            best		= ( ranked[0][0], cands[ranked[0][1]] )
+        elites			= [ logs[c] for _,c in ranked[:keep] ]
+        for d in range( len( names )):
+            xs			= [ x[d] for x in elites ]
+            m			= sum( xs ) / keep
+            s			= math.sqrt( sum( ( x - m ) ** 2 for x in xs ) / keep )
+            mu[d]		= .7 * m + .3 * mu[d]
+            sd[d]		= .7 * s + .3 * sd[d]
+        logging.info( "Iteration %3d: RMS error % 7.3fC (best % 7.3fC), spread %5.3f" % (
+            it + 1, ranked[0][0] * 5 / 9, best[0] * 5 / 9, math.exp( max( sd ))))
+        if max( sd ) < tolerance:
+            break
+    return best
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser( usage="%prog [options] history.csv" )
+    parser.add_option( '-o', '--output', dest='output',
+                       default='calibrated.json',
+                       help='Calibrated building file to write (default: calibrated.json)' )
+    parser.add_option( '-s', '--step', dest='step',
+                       type="float", default=300.,
+                       help='Model step, in seconds (default: 300)' )
+    parser.add_option( '-w', '--warmup', dest='warmup',
+                       type="float", default=6. * 60 * 60,
+                       help='Seconds of history to replay before measuring error (default: 21600)' )
+    parser.add_option( '-p', '--parameters', dest='parameters',
+                       default=None,
+                       help='Comma-separated parameters to fit, eg. R:fluid,BTU_ft3_F:wood (default: all)' )
+    parser.add_option( '-n', '--population', dest='population',
+                       type="int", default=48,
+                       help='Candidate parameter sets per iteration (default: 48)' )
+    parser.add_option( '-i', '--iterations', dest='iterations',
+                       type="int", default=25,
+                       help='Maximum iterations (default: 25)' )
+    parser.add_option( '-j', '--jobs', dest='jobs',
+                       type="int", default=0,
+                       help='Processes evaluating candidates, or 0 for one per CPU (default: 0)' )
+    (options, args) = parser.parse_args()
+    if len( args ) != 1:
+        parser.error( "A sensor history CSV file is required" )
+
+    begun			= time.time()
+    try:
+        times, series		= history( args[0], options.step )
+        rep			= replay( simulator.building( times[0], name='calibrate' ), times, series,
+                                          options.step, options.warmup )
+    except ValueError as exc:
+        parser.error( str( exc ))
+    base			= rep.parameters()
+    if options.parameters:
+        wanted			= options.parameters.split( ',' )
+        unknown			= [ p for p in wanted if p not in base ]
+        if unknown:
+            parser.error( "Unknown parameters: %s (known: %s)" % (
+                ', '.join( unknown ), ', '.join( sorted( base ))))
+        base			= dict( ( p, base[p] ) for p in wanted )
+    logging.info( "Calibrating %s over %d steps of %d measured spaces" % (
+        ', '.join( sorted( base )), len( times ), len( rep.measured )))
+
+    initialize( rep )
+    pool			= None
+    if ( options.jobs or multiprocessing.cpu_count() ) > 1:
+        pool			= multiprocessing.Pool( options.jobs or None, initializer=initialize,
+                                                        initargs=( rep, ))
+    try:
+        rms, params		= optimize( base, population=options.population,
+                                            iterations=options.iterations, pool=pool )
+    finally:
+        if pool:
+            pool.close()
+
+    cal				= { 'R': {}, 'BTU_ft3_F': {} }
+    for p,v in sorted( params.items() ):
+        table, name		= p.split( ':', 1 )
+        cal[table][name]	= v
+        logging.info( "%-24s % 10.4f (was % 10.4f)" % ( p, v, base[p] ))
+    cal['rms']			= rms * 5 / 9
+    cal['history']		= args[0]
+    with open( options.output, 'w' ) as f:
+        json.dump( cal, f, indent=4, sort_keys=True )
+    logging.info( "Calibrated to RMS error % 7.3fC in %.1fs; wrote %s" % (
+        cal['rms'], time.time() - begun, options.output ))
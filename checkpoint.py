@@ -0,0 +1,206 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import datetime
+import errno
+import logging
+import math
+import os
+import struct
+import tempfile
+import zlib
+
+from ledger import ledger
+
+#
+# Warm-start checkpoints of model and controller state.
+#
+#     Periodically saves every site's space temperatures, each zone PID controller's tuned gains
+# (Kp, Ki, Kd), output limits and P, I, D state, each site's energy ledger totals, sensor residual
+# monitors, and setpoint schedule state (each space's mode and setpoint, and optimal start), so that
+# a restarted simulator resumes where it left off, rather than starting every slab at the default
+# temperature, every integrator at zero, and every total and statistic afresh.  The (simulated) time
+# of the checkpoint is also saved.
+#
+#     The file is a compact binary image: a fixed header, the '\n' separated names of every value
+# (so a checkpoint may be restored into a model whose spaces or zones have since changed; only the
+# values whose names still match are restored), and the values as little-endian doubles.  The names
+# of the space and controller values are fixed by the model, and are encoded once; the names of the
+# ledger, residual and schedule values grow as they do (eg. as portals and sensors are first seen).
+# A CRC32 of the names and values detects a truncated or damaged file.  It is written to a temporary
+# file in the same directory, and atomically renamed over the previous checkpoint; a crash (or a
+# concurrent reader) never sees a partial checkpoint.
+#
+MAGIC				= b'HHck'
+VERSION				= 2
+HEADER				= struct.Struct( '<4sHdIII' )	# magic, version, now, names, values, crc
+replace				= getattr( os, 'replace', os.rename )	# Python 2: rename is atomic on POSIX
+PID				= ( 'Kp', 'Ki', 'Kd', 'Lo', 'Hi', 'P', 'I', 'D' )
+RESIDUAL			= ( 'count', 'mean', 'var', 'hi', 'lo' )
+SCHEDULE			= ( 'mode', 'setpoint', 'start', 'occupancy' )
+
+
+class checkpoint( object ):
+    def __init__( self, path, sites, interval = 60 * 60, groups = None ):
+        # The names and the order of the space and controller values are fixed by the model; compute
+        # them (and their encoding) once.  Names are "<kind>\t<site>\t...", eg. "space\tsite 1\tleft".
+        # Any restored ledger is created with the named 'groups' of spaces (see ledger).
+        self.path		= path
+        self.sites		= list( sites )
+        self.interval		= interval
+        self.groups		= groups
+        self.last		= None		# When last saved
+        self.spaces		= [ ( st, s ) for st in self.sites for s in sorted( st.spaces ) ]
+        self.cntrls		= [ ( st, z ) for st in self.sites for z in sorted( st.cntrl ) ]
+        self.names		= [ "space\t%s\t%s" % ( st.name, s ) for st,s in self.spaces ] \
+                                  + [ "pid\t%s\t%s\t%s" % ( st.name, z, v )
+                                      for st,z in self.cntrls for v in PID ]
+        self.encoded		= '\n'.join( self.names ).encode( 'utf-8' )
+
+    def due( self, now ):
+        return self.last is None or now - self.last >= self.interval
+
+    def values( self ):
+        # The names (beyond the fixed names) and values of the current state
+        vals			= [ st.spaces[s].conditions.temperature for st,s in self.spaces ]
+        for st,z in self.cntrls:
+            c			= st.cntrl[z][1]
+            vals.extend( ( c.Kp, c.Ki, c.Kd, c.Lout[0], c.Lout[1], c.P, c.I, c.D ))
+        names			= []
+        nan			= float( 'nan' )
+        for st in self.sites:
+            if st.energy is not None:
+                for k,btu in zip( st.energy.portals, st.energy.portal_total ):
+                    names.append( "energy\t%s\t%s\t%s\t%s" % (( st.name, ) + k ))
+                    vals.append( btu )
+            for n in sorted( st.residual.probes ):
+                p		= st.residual.probes[n]
+                names.extend( "residual\t%s\t%s\t%s" % ( st.name, n, v ) for v in RESIDUAL )
+                vals.extend( getattr( p, v ) for v in RESIDUAL )
+            if st.schedule:
+                sch		= st.schedule
+                for s in sorted( sch.weeks ):
+                    start, occupancy = sch.start.get( s, ( None, None ))
+                    mode	= sch.mode.get( s )
+                    names.extend( "schedule\t%s\t%s\t%s" % ( st.name, s, v ) for v in SCHEDULE )
+                    vals.extend( ( nan if mode is None else float( mode ), st.temp.get( s, nan ),
+                                   nan if start is None else start,
+                                   nan if occupancy is None else occupancy ))
+                if sch.planned:
+                    names.append( "schedule\t%s\tplanned" % st.name )
+                    vals.append( datetime.date( *sch.planned ).toordinal() )
+        return names, vals
+
+    def save( self, now ):
+        # Atomically replace the checkpoint file with the current state.
+        names, vals		= self.values()
+        encoded			= self.encoded
+        if names:
+            encoded	       += ( '\n' + '\n'.join( names )).encode( 'utf-8' )
+        body			= encoded + struct.pack( '<%dd' % len( vals ), *vals )
+        head			= HEADER.pack( MAGIC, VERSION, now, len( encoded ), len( vals ),
+                                               zlib.crc32( body ) & 0xffffffff )
+        fd, tmp			= tempfile.mkstemp( dir=os.path.dirname( os.path.abspath( self.path )),
+                                                    prefix=os.path.basename( self.path ) + '.' )
+        try:
+            with os.fdopen( fd, 'wb' ) as f:
+                f.write( head + body )
+                f.flush()
+                os.fsync( f.fileno() )
+            replace( tmp, self.path )
+        except:
+            os.unlink( tmp )
+            raise
+        self.last		= now
+        logging.debug( "Checkpoint: %d spaces, %d controllers, %d other values saved to %s" % (
+            len( self.spaces ), len( self.cntrls ), len( names ), self.path ))
+
+    def restore( self ):
+        # Restore the state from the checkpoint file (if any).  Returns the (simulated) time it was
+        # saved, or None if there is no checkpoint file.  A damaged checkpoint raises ValueError, and
+        # any other failure to read it raises.
+        try:
+            with open( self.path, 'rb' ) as f:
+                data		= f.read()
+        except ( IOError, OSError ) as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            return None
+        if len( data ) < HEADER.size:
+            raise ValueError( "Checkpoint %s: truncated header" % self.path )
+        magic, version, when, names, count, crc = HEADER.unpack_from( data )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError( "Checkpoint %s: unrecognized format" % self.path )
+        body			= data[HEADER.size:]
+        if len( body ) != names + 8 * count or zlib.crc32( body ) & 0xffffffff != crc:
+            raise ValueError( "Checkpoint %s: damaged" % self.path )
+        vals			= struct.unpack_from( '<%dd' % count, body, names )
+        keys			= body[:names].decode( 'utf-8' ).split( '\n' ) if names else []
+        if len( keys ) != count:
+            raise ValueError( "Checkpoint %s: damaged" % self.path )
+
+        # Index the saved values by name, and the rest of each site's state by site and kind (by name,
+        # not position, as the saved sites and spaces may differ from the model's).  Then apply those
+        # that still match the model.
+        saved			= dict( zip( keys, vals ))
+        other			= {}		# { site: { kind: [ ( [name,...], value ), ... ] } }
+        for k,v in saved.items():
+            part		= k.split( '\t' )
+            if len( part ) >= 3 and part[0] not in ( 'space', 'pid' ):
+                other.setdefault( part[1], {} ).setdefault( part[0], [] ).append( ( part[2:], v ))
+        restored		= 0
+        for st,s in self.spaces:
+            t			= saved.get( "space\t%s\t%s" % ( st.name, s ))
+            if t is not None:
+                st.spaces[s].conditions.temperature = t
+                restored       += 1
+        for st,z in self.cntrls:
+            v			= [ saved.get( "pid\t%s\t%s\t%s" % ( st.name, z, n )) for n in PID ]
+            if None not in v:
+                c		= st.cntrl[z][1]
+                c.Kp, c.Ki, c.Kd	= v[0:3]
+                c.Lout		= [ v[3], v[4] ]
+                c.P, c.I, c.D	= v[5:8]
+                restored       += 1
+        logging.info( "Checkpoint: %d of %d spaces and controllers restored from %s" % (
+            restored, len( self.spaces ) + len( self.cntrls ), self.path ))
+
+        for st in self.sites:
+            self.resume( st, other.get( st.name, {} ), when )
+        return when
+
+    def resume( self, st, other, when ):
+        # Restore a site's energy ledger totals (checkpointed as of 'when', so the energy over any
+        # later period excludes that before it), residual monitors, and schedule state.
+        energy			= dict( ( tuple( k ), btu ) for k,btu in other.get( 'energy', [] )
+                                        if len( k ) == 3 )
+        if energy:
+            if st.energy is None:
+                st.energy	= ledger( energy.keys(), self.groups )
+            st.energy.add( energy )
+            st.energy.checkpoint( when )
+        for k,value in other.get( 'residual', [] ):
+            if len( k ) == 2 and k[1] in RESIDUAL:
+                setattr( st.residual.probe( k[0] ), k[1], int( value ) if k[1] == 'count' else value )
+        for p in st.residual.probes.values():
+            p.diverging		= abs( p.mean ) > st.residual.diverge
+        st.residual.diverging	= sum( p.diverging for p in st.residual.probes.values() )
+        sch			= st.schedule
+        if sch:
+            state		= dict( ( tuple( k ), value ) for k,value in other.get( 'schedule', [] ))
+            for s in sch.weeks:
+                mode, setpoint, start, occupancy = [ state.get( ( s, v ), math.nan )
+                                                     for v in SCHEDULE ]
+                if not math.isnan( mode ):
+                    sch.mode[s]	= bool( mode )
+                if not math.isnan( setpoint ):
+                    st.temp[s]	= setpoint
+                if not math.isnan( start ) and not math.isnan( occupancy ):
+                    sch.start[s]	= ( start, occupancy )
+            planned		= state.get( ( 'planned', ))
+            if planned is not None and 1 <= planned <= datetime.date.max.toordinal():
+                sch.planned	= datetime.date.fromordinal( int( planned )).timetuple()[:3]
+        logging.info( "Checkpoint: %s: %d ledger portals, %d sensors, %d schedules restored" % (
+            st.name or 'site', len( energy ), len( st.residual.probes ),
+            len( sch.weeks ) if sch else 0 ))
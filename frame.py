@@ -0,0 +1,154 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import array
+import logging
+
+from radiance import radiance
+
+#
+# Derived (display) state of a site's spaces, in preallocated slots.
+#
+#     Each step, every displayed space's portal loads, mean radiant temperature, heat call and Fanger
+# comfort are derived from the step's results.  Rather than attaching fresh dicts, tuples and objects
+# to the live space objects each frame, they are stored in flat arrays (and fixed lists), allocated
+# once, indexed by position: a slot per space, and a slot per portal key (eg. ('right','world',
+# '...Window Gable 1')), each from the perspective of one of its spaces.  Each portal key's portal
+# object (and its area) is found once, when the key is first seen; not by searching every frame.
+#
+#     Every space's mean radiant temperature is computed at once, the first time any space is derived
+# each step, by the (precomputed) radiance engine; see radiance.py.  This also marks every space as
+# not yet derived for the new step (space_valid).  Each space's Fanger comfort model arguments
+# are also kept in a slot, refreshed in place; the model itself is created anew each step.
+#
+#     Consumers read the state through read-only views by name (eg. frm.radiant['left']), which
+# refer to the underlying slots, and so are always current; they are also created only once.
+#
+class view( object ):
+    # A read-only view of a slot array (or list), by name
+    __slots__			= ( 'values', 'index' )
+
+    def __init__( self, values, index ):
+        self.values		= values
+        self.index		= index
+
+    def __getitem__( self, key ):
+        return self.values[self.index[key]]
+
+    def get( self, key, default = None ):
+        i			= self.index.get( key )
+        return default if i is None else self.values[i]
+
+    def __contains__( self, key ):
+        return key in self.index
+
+    def __len__( self ):
+        return len( self.index )
+
+    def __iter__( self ):
+        return iter( self.index )
+
+    def keys( self ):
+        return list( self.index )
+
+    def items( self ):
+        return [ ( k, self.values[i] ) for k,i in self.index.items() ]
+
+
+class frame( object ):
+    def __init__( self, spaces, portals = () ):
+        self.spaces		= sorted( spaces )	# [space,...]
+        self.index		= dict( ( s, i ) for i,s in enumerate( self.spaces ))
+        n			= len( self.spaces )
+        self.space_valid	= array.array( 'b', [ 0 ] * n )	# space has been derived this step
+        self.space_radiant	= array.array( 'd', [ 0. ] * n )	# F
+        self.space_heatcall	= array.array( 'd', [ 0. ] * n )	# %, of zone's primary space
+        self.space_pmv		= array.array( 'd', [ 0. ] * n )
+        self.space_clo		= array.array( 'd', [ 0. ] * n )
+        self.space_met		= array.array( 'd', [ 0. ] * n )
+        self.space_feels	= [ "unknown" ] * n
+        self.space_clothing	= [ "unknown" ] * n
+        self.space_metabolism	= [ "unknown" ] * n
+        self.space_portals	= [ array.array( 'i' ) for _ in range( n ) ]	# each space's portal slots
+        self.space_kwds		= [ {} for _ in range( n ) ]	# each space's fanger arguments (clo, met, ...)
+
+        self.portals		= []		# [(space,onto,portal),...]
+        self.pindex		= {}		# { (space,onto,portal): j, ... }
+        self.portal		= []		# [portal object,...] of each key
+        self.portal_area	= array.array( 'd' )	# ft^2
+        self.portal_btu_h	= array.array( 'd' )	# BTU/h gained (+) or lost (-) by its space
+        self.engine		= None		# radiance, of the current portals
+        self.radiated		= None		# results (step) radiant temperatures computed for
+        portals			= sorted( portals )
+        for k in portals:
+            self.extend( k, spaces )
+        self.known		= len( portals )	# results keys seen
+
+        self.valid		= view( self.space_valid, self.index )
+        self.radiant		= view( self.space_radiant, self.index )
+        self.heatcall		= view( self.space_heatcall, self.index )
+        self.pmv		= view( self.space_pmv, self.index )
+        self.clo		= view( self.space_clo, self.index )
+        self.met		= view( self.space_met, self.index )
+        self.feels		= view( self.space_feels, self.index )
+        self.clothing		= view( self.space_clothing, self.index )
+        self.metabolism		= view( self.space_metabolism, self.index )
+        self.load		= view( self.portal_btu_h, self.pindex )
+
+    def extend( self, key, spaces ):
+        # Add a slot for a new portal key; finds its portal object, on either of its spaces.
+        # Normally only done when the frame is created, but a key first seen later is also accepted.
+        # Keys not between two spaces (eg. the plant's ('zone 1','hydronic','pumps')) are ignored.
+        rs, ro, rp		= key
+        if rs not in spaces or ro not in spaces:
+            return None
+        portal			= None
+        for p in spaces[rs].portals:
+            if ro == p.onto and rp == p.name:
+                portal		= p
+                break
+        if portal is None:
+            for p in spaces[ro].portals:
+                if rs == p.onto and rp == p.name:
+                    portal	= p
+                    break
+        if portal is None:
+            logging.info( "Couldn't find portal named %s" % ( rp ))
+            return None
+        j			= len( self.portals )
+        self.portals.append( key )
+        self.pindex[key]	= j
+        self.portal.append( portal )
+        self.portal_area.append( portal.area() )
+        self.portal_btu_h.append( 0. )
+        self.space_portals[self.index[rs]].append( j )
+        self.engine		= None
+        return j
+
+    def track( self, results, spaces ):
+        # Add slots for any of a step's results keys not yet seen (only scanned if there are more)
+        if len( results ) > self.known:
+            for k in results:
+                if k not in self.pindex:
+                    logging.debug( "Frame: new portal %r" % ( k, ))
+                    self.extend( k, spaces )
+            self.known		= len( results )
+
+    def radiate( self, results, spaces ):
+        # Compute every space's mean radiant temperature, once per step's results; no space has yet
+        # been derived from them.
+        if results is self.radiated:
+            return
+        valid			= self.space_valid
+        for i in range( len( valid )):
+            valid[i]		= 0
+        if self.engine is None:
+            self.engine		= radiance( spaces, self.spaces, self.portals, self.portal,
+                                            self.portal_area, self.space_portals )
+        self.engine.compute( self.space_radiant )
+        self.radiated		= results
+
+    def loads( self, s ):
+        # Each of space s's (portal name, BTU/h) loads
+        return [ ( self.portals[j][2], self.portal_btu_h[j] ) for j in self.space_portals[self.index[s]] ]
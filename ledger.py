@@ -0,0 +1,134 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import array
+import bisect
+import logging
+
+#
+# Energy accounting.  Accumulates the BTU gained (+) or lost (-) by each space via each of its
+# portals, as computed by each step of the model (eg. { ('right','world','...Window Gable 1'): -12.3,
+# ... }).  Totals are kept per portal, per space, and per named group of spaces (eg. each zone, and
+# all of its floors, slab and water), in flat arrays indexed by position; each step adds the step's
+# results in place.
+#
+# Periodically (each 'interval' seconds of simulated time), the cumulative totals are checkpointed.
+# The energy over any range of time is then simply the difference between the checkpoints bounding
+# it, so monthly or seasonal reports require neither a time series, nor re-scanning one.  At most
+# 'limit' checkpoints are retained (default: a year of hourly checkpoints).
+#
+# Each portal's heat appears twice; once from each space's side.  Portal queries by name report
+# the heat from the perspective of the space that is not one of the 'outside' spaces.
+#
+class ledger( object ):
+    def __init__( self, portals, groups = None, interval = 60 * 60, limit = 366 * 24,
+                  outside = ( 'world', 'ground' )):
+        self.outside		= outside
+        self.portals		= []		# [(space,onto,portal),...]
+        self.index		= {}		# { (space,onto,portal): i, ... }
+        self.spaces		= []		# [space,...]
+        self.groups		= sorted( groups or {} )
+        self.members		= dict( groups or {} )
+        self.portal_space	= array.array( 'i' )	# portal i's space index
+        self.portal_group	= array.array( 'i' )	# portal i's group index (or -1)
+        self.portal_total	= array.array( 'd' )
+        self.space_total	= array.array( 'd' )
+        self.group_total	= array.array( 'd', [ 0. ] * len( self.groups ))
+        self.interval		= interval
+        self.limit		= limit
+        self.times		= []		# [when,...], and the cumulative totals at each
+        self.checkpoints	= []		# [(portal_total,space_total,group_total),...]
+        self.dropped		= 0		# Count of oldest checkpoints discarded
+        for k in sorted( portals ):
+            self.extend( k )
+
+    def extend( self, key ):
+        # Add a new portal key (and its space, if new).  Normally only done when the ledger is
+        # created, but a key first seen later (eg. a newly connected portal) is also accepted.
+        s			= key[0]
+        if s not in self.spaces:
+            self.spaces.append( s )
+            self.space_total.append( 0. )
+        g			= -1
+        for i,n in enumerate( self.groups ):
+            if s in self.members[n]:
+                g		= i
+                break
+        i			= len( self.portals )
+        self.portals.append( key )
+        self.index[key]		= i
+        self.portal_space.append( self.spaces.index( s ))
+        self.portal_group.append( g )
+        self.portal_total.append( 0. )
+        for cp in self.checkpoints:
+            cp[0].append( 0. )
+            if len( cp[1] ) < len( self.space_total ):
+                cp[1].append( 0. )
+        return i
+
+    def add( self, results, now = None ):
+        # Accumulate one step's { key: BTU, ... } results, for the step ending at 'now'.  If 'now'
+        # is supplied, checkpoint the totals (incl. this step) whenever another 'interval' of time has
+        # elapsed.
+        for k,btu in results.items():
+            i			= self.index.get( k )
+            if i is None:
+                logging.debug( "Ledger: new portal %r" % ( k, ))
+                i		= self.extend( k )
+            self.portal_total[i]       += btu
+            self.space_total[self.portal_space[i]] += btu
+            g			= self.portal_group[i]
+            if g >= 0:
+                self.group_total[g]    += btu
+        if now is not None and ( not self.times or now - self.times[-1] >= self.interval ):
+            self.checkpoint( now )
+
+    def checkpoint( self, now ):
+        self.times.append( now )
+        self.checkpoints.append( ( array.array( 'd', self.portal_total ),
+                                   array.array( 'd', self.space_total ),
+                                   array.array( 'd', self.group_total )))
+        if len( self.times ) > self.limit:
+            del self.times[0]
+            del self.checkpoints[0]
+            self.dropped       += 1
+
+    def totals( self, when = None ):
+        # The cumulative (portal,space,group) totals as of the latest checkpoint at or before
+        # 'when', or the current totals if None.  Before the first checkpoint, all are zero; but if
+        # the checkpoints before 'when' have since been discarded (see 'limit'), raises ValueError.
+        if when is None:
+            return self.portal_total, self.space_total, self.group_total
+        i			= bisect.bisect_right( self.times, when )
+        if i == 0 and self.dropped:
+            raise ValueError( "Ledger: no checkpoint at or before %s; oldest retained is %s" % (
+                when, self.times[0] ))
+        if i == 0:
+            return ( array.array( 'd', [ 0. ] * len( self.portal_total )),
+                     array.array( 'd', [ 0. ] * len( self.space_total )),
+                     array.array( 'd', [ 0. ] * len( self.group_total )))
+        return self.checkpoints[i-1]
+
+    def between( self, since = None, until = None ):
+        # Returns the BTU gained/lost over the period (since,until] as dicts of portal, space and
+        # group totals; None means from the beginning, or up to the present.
+        lo			= self.totals( since ) if since is not None else None
+        hi			= self.totals( until )
+        def delta( which, names ):
+            return dict( ( n, hi[which][i] - ( lo[which][i] if lo else 0. ))
+                         for i,n in enumerate( names ))
+        return delta( 0, self.portals ), delta( 1, self.spaces ), delta( 2, self.groups )
+
+    def portal( self, name, since = None, until = None ):
+        # The total BTU over the period via every portal whose name contains 'name' (eg. "Gable"),
+        # gained (+) or lost (-) by the inside space.
+        portals,_,_		= self.between( since, until )
+        return sum( btu for k,btu in portals.items()
+                    if name in k[2] and k[0] not in self.outside )
+
+    def space( self, name, since = None, until = None ):
+        return self.between( since, until )[1].get( name, 0. )
+
+    def group( self, name, since = None, until = None ):
+        return self.between( since, until )[2].get( name, 0. )
@@ -0,0 +1,165 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import array
+import logging
+import math
+import os
+import tempfile
+
+from hydronic import F_to_C
+from ownercredit import misc
+
+import webapi
+from checkpoint import replace
+
+#
+# Prometheus text-format metrics of the simulation's KPIs, for monitoring it like any other service.
+#
+#     The set of series (each site's zones' heat calls and PID terms, and its spaces' temperatures
+# and PMVs, labelled by site; the step latency and the simulated-to-real time ratio) is fixed by the
+# model; their names, labels and the page's layout are rendered once, into a template with a
+# placeholder per value.  Each step (of every site), the values are gathered into a preallocated
+# array, and the page is rendered in a single formatting operation and published as a
+# webapi.snapshot (for /metrics); scrapes just send the most recently rendered page, and never
+# contend with the simulation loop.  The latency and time ratio are aggregated over the last
+# 'window' steps, in fixed-size ring buffers.
+#
+#     The page may also be written to a file (eg. for node_exporter's textfile collector), at most
+# every 'period' seconds (real time); it is written to a temporary file and atomically renamed, so
+# a reader never sees a partial page.
+#
+CONTENT_TYPE			= 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class ring( object ):
+    # The last 'size' samples of a value (and when they were taken), in preallocated arrays
+    def __init__( self, size ):
+        self.values		= array.array( 'd', [ 0. ] * size )
+        self.times		= array.array( 'd', [ 0. ] * size )
+        self.next		= 0		# Slot of the next sample
+        self.count		= 0
+
+    def add( self, value, when = 0. ):
+        self.values[self.next]	= value
+        self.times[self.next]	= when
+        self.next		= ( self.next + 1 ) % len( self.values )
+        self.count		= min( self.count + 1, len( self.values ))
+
+    def oldest( self ):
+        return ( self.next - self.count ) % len( self.values )
+
+    def newest( self ):
+        return ( self.next - 1 ) % len( self.values )
+
+    def mean( self ):
+        return sum( self.values[:self.count] ) / self.count if self.count else math.nan
+
+    def max( self ):
+        return max( self.values[:self.count] ) if self.count else math.nan
+
+    def last( self ):
+        return self.values[self.newest()] if self.count else math.nan
+
+
+class exporter( object ):
+    def __init__( self, sites, heatcall, comfort = (), path = None, period = 15., window = 60,
+                  prefix = 'hydronic_' ):
+        # The sites' series; a (name, type, help, [ (labels, getter), ... ]) for each metric.  Each
+        # getter returns the series' current value.  A zone's applied heat call (%) is
+        # heatcall( site, zone ), and the PMV of each site's 'comfort' spaces is exported.
+        self.path		= path
+        self.period		= period
+        self.written		= None		# When (real time) the file was last written
+        self.latency		= ring( window )	# seconds per step
+        self.steps		= ring( window )	# simulated time at each step (real time)
+        self.snapshot		= webapi.snapshot( content_type=CONTENT_TYPE )
+        self.count		= 0
+
+        def temperature( st, s ):
+            return lambda: F_to_C( st.spaces[s].conditions.temperature )
+        def pmv( st, s ):
+            return lambda: st.frame.pmv[s] if st.frame is not None and st.frame.valid.get( s ) \
+                else math.nan
+        def applied( st, z ):
+            return lambda: heatcall( st, z )
+        def term( st, z, t ):
+            return lambda: getattr( st.cntrl[z][1], t )
+
+        zones			= [ ( st, z ) for st in sites for z in sorted( st.cntrl, key=misc.natural ) ]
+        spaces			= [ ( st, s ) for st in sites for s in sorted( st.spaces, key=misc.natural ) ]
+        comfort			= [ ( st, s ) for st in sites for s in sorted( comfort, key=misc.natural ) ]
+        def labelled( st, **kwds ):
+            return dict( kwds, site=st.name or 'site' )
+        self.series		= [
+            ( 'heat_call_percent', 'gauge', "Zone applied heat call (PID output, or Modbus command), %",
+              [ ( labelled( st, zone=z ), applied( st, z )) for st,z in zones ] ),
+            ( 'pid_term', 'gauge', "Zone PID controller P, I and D terms",
+              [ ( labelled( st, zone=z, term=t ), term( st, z, t ))
+                for st,z in zones for t in ( 'P', 'I', 'D' ) ] ),
+            ( 'temperature_celsius', 'gauge', "Space (incl. floor, slab and zone water) temperature, C",
+              [ ( labelled( st, space=s ), temperature( st, s )) for st,s in spaces ] ),
+            ( 'pmv', 'gauge', "Space Fanger predicted mean vote",
+              [ ( labelled( st, space=s ), pmv( st, s )) for st,s in comfort ] ),
+            ( 'step_latency_seconds', 'gauge', "Wall-clock seconds per model step, over the window",
+              [ ( dict( stat='last' ), self.latency.last ),
+                ( dict( stat='mean' ), self.latency.mean ),
+                ( dict( stat='max' ), self.latency.max ) ] ),
+            ( 'sim_real_ratio', 'gauge', "Simulated seconds per real second, over the window",
+              [ ( dict(), self.ratio ) ] ),
+            ( 'steps_total', 'counter', "Model steps published",
+              [ ( dict(), lambda: self.count ) ] ),
+        ]
+
+        # Render the page template once; label values are escaped, and any '%' doubled
+        def label( v ):
+            return str( v ).replace( '\\', '\\\\' ).replace( '"', '\\"' ).replace( '\n', '\\n' )
+        lines			= []
+        self.getters		= []
+        for metric, kind, doc, series in self.series:
+            lines.append( ( "# HELP %s%s %s" % ( prefix, metric, doc )).replace( '%', '%%' ))
+            lines.append( ( "# TYPE %s%s %s" % ( prefix, metric, kind )).replace( '%', '%%' ))
+            for labels, getter in series:
+                pairs		= ','.join( '%s="%s"' % ( k, label( labels[k] )) for k in sorted( labels ))
+                line		= "%s%s%s" % ( prefix, metric, "{%s}" % pairs if pairs else "" )
+                lines.append( line.replace( '%', '%%' ) + ' %.9g' )
+                self.getters.append( getter )
+        self.template		= '\n'.join( lines ) + '\n'
+        self.values		= array.array( 'd', [ 0. ] * len( self.getters ))
+
+    def ratio( self ):
+        # Simulated seconds elapsed per real second, over the steps in the window
+        old, new		= self.steps.oldest(), self.steps.newest()
+        real			= self.steps.times[new] - self.steps.times[old]
+        return ( self.steps.values[new] - self.steps.values[old] ) / real \
+            if self.steps.count > 1 and real > 0 else math.nan
+
+    def update( self, now, real, latency = None ):
+        # Record a step (of every site, to simulated time 'now', at real time 'real'), taking 'latency'
+        # seconds of real time, and render and publish the page (and write the file, if it is due).
+        self.count	       += 1
+        self.steps.add( now, real )
+        if latency is not None:
+            self.latency.add( latency, real )
+        values			= self.values
+        for i,getter in enumerate( self.getters ):
+            values[i]		= getter()
+        body			= ( self.template % tuple( values )).encode( 'utf-8' )
+        self.snapshot.update( body )
+        if self.path and ( self.written is None or real - self.written >= self.period ):
+            self.written	= real
+            self.write( body )
+
+    def write( self, body ):
+        # Atomically replace the metrics file with the rendered page
+        fd, tmp			= tempfile.mkstemp( dir=os.path.dirname( os.path.abspath( self.path )),
+                                                    prefix=os.path.basename( self.path ) + '.' )
+        try:
+            with os.fdopen( fd, 'wb' ) as f:
+                f.write( body )
+            os.chmod( tmp, 0o644 )
+            replace( tmp, self.path )
+        except Exception as exc:
+            os.unlink( tmp )
+            logging.warning( "Metrics: failed to write %s: %s" % ( self.path, exc ))
@@ -0,0 +1,343 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import array
+import multiprocessing
+
+from hydronic import BTU_ft3_F
+
+#
+# Lumped thermal (RC) network.  Each space is a node with a heat capacity C (BTU/F, from its volume
+# and material), and each portal is a conductance UA (BTU/h/F, from its area and R value, including
+# its film) between the nodes of the spaces it connects.  Some nodes (eg. world, ground) are fixed
+# temperature boundaries; their temperatures are inputs (eg. weather), not state.
+#
+#     Every node's state is held in flat arrays indexed by node number (temperature T, F; injected
+# heat Q, BTU/h), so that many models (eg. many sites' buildings) may be added to one network and
+# stepped together.  Since the hydronic floor assemblies are very stiff (thin floors tightly coupled
+# to their slabs), steps are implicit (backward Euler); the free nodes are partitioned into the
+# connected components separated by the fixed boundary nodes, and each component's (small, dense)
+# system is LU factored once per step size.  The components' factors are stacked into one block
+# diagonal sparse system (see system), so each step is just one sparse forward/back substitution
+# for the whole network; eg. every site of a campus is solved together.  (The repo has no numeric
+# array dependency, so the substitution itself is a flat pure-Python loop over the non-zeros.)
+#
+#     Since the components are coupled only via the fixed boundary nodes (whose temperatures are
+# inputs, set once before each step), each step's components are independent, and may be solved in
+# parallel.  Once the network is complete, 'parallel' moves its state (C, T, Q, UA) into shared
+# memory, and distributes its components across worker processes (balanced by solution cost); each
+# step then just sends every worker the step size, and waits for them to solve their components.
+#
+#     Steps may also be adaptive (see adapt); the error of each step is estimated by comparing one
+# full step with two half steps, and the step is halved until the error is within tolerance (and
+# doubled, when well within).  Since the step sizes are then powers of two (fractions of the largest
+# step), the stacked system keeps the factors of the few recently used step sizes.
+#
+def capacity( sp ):
+    # A space's heat capacity in BTU/F, from its volume (ft^3) and material
+    w, l, h			= sp.size[:3]
+    return BTU_ft3_F[sp.conditions.what] * w * l * h
+
+
+def conductance( p ):
+    # A portal's conductance in BTU/h/F, from its area (ft^2) and total R value (incl. film)
+    r				= p.R + ( getattr( p, 'film', 0 ) or 0 )
+    return p.area() / r if r > 0 else None
+
+
+class network( object ):
+    def __init__( self ):
+        self.names		= []		# [name,...]; index is node number
+        self.index		= {}		# { name: node, ... }
+        self.C			= array.array( 'd' )
+        self.T			= array.array( 'd' )
+        self.Q			= array.array( 'd' )
+        self.fixed		= array.array( 'b' )
+        self.ei			= array.array( 'i' )	# edge e connects nodes ei[e] <-> ej[e]
+        self.ej			= array.array( 'i' )
+        self.UA			= array.array( 'd' )
+        self.keys		= []		# [(space,portal),...]; edge e's source portal
+        self.parts		= None		# [component,...], computed on demand
+        self.free		= None		# [node,...], of every free (not fixed) node
+        self.generation		= 0		# incremented whenever any C or UA is changed
+        self.workers		= []		# [(process,connection),...], if stepping in parallel
+        self.stack		= None		# system, of the components solved by this process
+
+    def node( self, name, C, T, fixed = False ):
+        i			= len( self.names )
+        self.names.append( name )
+        self.index[name]	= i
+        self.C.append( C )
+        self.T.append( T )
+        self.Q.append( 0. )
+        self.fixed.append( bool( fixed ))
+        self.parts		= None
+        return i
+
+    def edge( self, i, j, UA, key = None ):
+        e			= len( self.UA )
+        self.ei.append( i )
+        self.ej.append( j )
+        self.UA.append( UA )
+        self.keys.append( key )
+        self.parts		= None
+        return e
+
+    def add( self, spaces, prefix = '', fixed = ( 'world', 'ground' )):
+        # Add a model's { name: space, ... } to the network, its nodes named prefix + name.  The
+        # 'fixed' spaces are boundaries shared by every model added, and are not prefixed.
+        def named( n ):
+            return n if n in fixed else prefix + n
+        for n in sorted( spaces ):
+            if named( n ) not in self.index:
+                sp		= spaces[n]
+                self.node( named( n ), capacity( sp ) if n not in fixed else 0.,
+                           sp.conditions.temperature, fixed=n in fixed )
+        for n in sorted( spaces ):
+            for p in spaces[n].portals:
+                ua		= conductance( p )
+                if ua:
+                    self.edge( self.index[named( n )], self.index[named( p.onto )], ua, key=( n, p.name ))
+
+    def changed( self ):
+        # Any C or UA has been changed; re-factor on next step.
+        self.generation	       += 1
+
+    def partition( self ):
+        # Find the connected components of free nodes (joined by edges not via a fixed node).
+        parent			= list( range( len( self.names )))
+        def root( i ):
+            while parent[i] != i:
+                parent[i]	= parent[parent[i]]
+                i		= parent[i]
+            return i
+        for e in range( len( self.UA )):
+            i, j		= self.ei[e], self.ej[e]
+            if not self.fixed[i] and not self.fixed[j]:
+                parent[root( i )] = root( j )
+        groups			= {}
+        for i in range( len( self.names )):
+            if not self.fixed[i]:
+                groups.setdefault( root( i ), [] ).append( i )
+        self.parts		= [ component( self, nodes ) for _,nodes in sorted( groups.items() ) ]
+        self.free		= [ i for i in range( len( self.names )) if not self.fixed[i] ]
+        self.stack		= system( self, self.parts )
+        return self.parts
+
+    def step( self, delta ):
+        # Advance every component's temperatures by 'delta' seconds.
+        if self.parts is None:
+            self.partition()
+        h			= delta / 60 / 60
+        for _,conn in self.workers:
+            conn.send( ( h, self.generation ))
+        solve( self, self.stack, h, self.generation )
+        for _,conn in self.workers:
+            conn.recv()
+
+    def adapt( self, delta, tolerance, least = 1. ):
+        # Step by up to 'delta' seconds, halving the step (but never below 'least' seconds) until the
+        # estimated error (the greatest difference in F between one full step and two half steps) is
+        # within 'tolerance'.  The (more accurate) two half steps are kept.  Returns the step taken,
+        # its estimated error, and the step suggested next; doubled if well within tolerance, since
+        # the error grows as the square of the step.
+        if self.parts is None:
+            self.partition()
+        T, free			= self.T, self.free
+        start			= [ T[i] for i in free ]
+        full			= None
+        while True:
+            for i,t in zip( free, start ):
+                T[i]		= t
+            self.step( delta / 2 )
+            half		= [ T[i] for i in free ]
+            self.step( delta / 2 )
+            twice		= [ T[i] for i in free ]
+            if full is None:
+                for i,t in zip( free, start ):
+                    T[i]	= t
+                self.step( delta )
+                full		= [ T[i] for i in free ]
+            error		= max( abs( a - b ) for a,b in zip( full, twice )) if free else 0.
+            if error <= tolerance or delta / 2 < least:
+                break
+            delta, full		= delta / 2, half	# The first half step is the next full step
+        for i,t in zip( free, twice ):
+            T[i]		= t
+        return delta, error, delta * 2 if error < tolerance / 4 else delta
+
+    def parallel( self, processes = None ):
+        # Step the components in (up to) this many processes (default: one per CPU), including this
+        # one.  The network's nodes and edges may not be added to after this, but C and UA may still
+        # be changed (followed by changed()).
+        if self.workers:
+            self.close()
+        if self.parts is None:
+            self.partition()
+        processes		= min( processes or multiprocessing.cpu_count(), len( self.parts ))
+        if processes < 2:
+            return 0
+        for n in ( 'C', 'T', 'Q', 'UA' ):
+            setattr( self, n, multiprocessing.RawArray( 'd', getattr( self, n )))
+        # Greedily assign the most costly remaining component to the least loaded process
+        loads			= [ 0 ] * processes
+        shares			= [ [] for _ in range( processes ) ]
+        for part in sorted( self.parts, key=lambda part: -len( part.nodes ) ** 2 ):
+            p			= loads.index( min( loads ))
+            loads[p]	       += len( part.nodes ) ** 2
+            shares[p].append( part )
+        self.stack		= system( self, shares[0] )
+        for n,share in enumerate( shares[1:] ):
+            conn, child		= multiprocessing.Pipe()
+            proc		= multiprocessing.Process( target=worker, args=( child, self, share ),
+                                                           name="network %d" % ( n + 1 ))
+            proc.daemon		= True
+            proc.start()
+            child.close()
+            self.workers.append( ( proc, conn ))
+        return processes
+
+    def close( self ):
+        # Stop any worker processes; subsequent steps are solved in this process.
+        for proc,conn in self.workers:
+            conn.send( None )
+            proc.join()
+        self.workers		= []
+        if self.parts is not None:
+            self.stack		= system( self, self.parts )
+
+    def __getstate__( self ):
+        # Worker processes are given the network's state, but not its workers.
+        state			= dict( self.__dict__ )
+        state['workers']	= []
+        return state
+
+    def flows( self ):
+        # The heat (BTU/h) flowing across each edge e, from node ej[e] into node ei[e].
+        T			= self.T
+        return [ self.UA[e] * ( T[self.ej[e]] - T[self.ei[e]] ) for e in range( len( self.UA )) ]
+
+
+class component( object ):
+    # A connected set of free nodes.  Its backward Euler step solves A . T' = C/h . T + Q + B . T_fixed,
+    # where A = diag( C/h + sum UA ) - UA (between the component's own nodes).
+    def __init__( self, net, nodes ):
+        self.nodes		= nodes
+        local			= dict( ( i, a ) for a,i in enumerate( nodes ))
+        self.inner		= []		# [(a,b,e),...]; edge e between local nodes a,b
+        self.outer		= []		# [(a,j,e),...]; edge e from local node a to fixed node j
+        for e in range( len( net.UA )):
+            i, j		= net.ei[e], net.ej[e]
+            if i in local and j in local:
+                self.inner.append( ( local[i], local[j], e ))
+            elif i in local and net.fixed[j]:
+                self.outer.append( ( local[i], j, e ))
+            elif j in local and net.fixed[i]:
+                self.outer.append( ( local[j], i, e ))
+
+    def factor( self, net, h ):
+        # Assemble A, and LU factor it in place (no pivoting; A is diagonally dominant).
+        n			= len( self.nodes )
+        A			= [ [ 0. ] * n for _ in range( n ) ]
+        for a,i in enumerate( self.nodes ):
+            A[a][a]		= net.C[i] / h
+        for a,b,e in self.inner:
+            ua			= net.UA[e]
+            A[a][a]	       += ua
+            A[b][b]	       += ua
+            A[a][b]	       -= ua
+            A[b][a]	       -= ua
+        for a,_,e in self.outer:
+            A[a][a]	       += net.UA[e]
+        for k in range( n ):
+            pivot		= A[k][k]
+            for r in range( k + 1, n ):
+                if A[r][k]:
+                    f		= A[r][k] / pivot
+                    A[r][k]	= f
+                    row, krow	= A[r], A[k]
+                    for c in range( k + 1, n ):
+                        row[c] -= f * krow[c]
+        return A
+
+
+class system( object ):
+    # The backward Euler systems of a set of components, stacked into one block diagonal sparse
+    # system.  Each component's (small) block is LU factored densely, but only its non-zero factors
+    # are kept, in flat arrays by row (with the upper factors pre-divided by their diagonal).  Each
+    # step is then a single sparse forward/back substitution over all the components at once, with
+    # no per-component overhead, and no work for the zeros of the blocks.  Only the factors of the few
+    # most recently used step sizes are kept.
+    def __init__( self, net, parts ):
+        self.nodes		= array.array( 'i' )	# row r's node
+        self.outer		= []		# [(r,j,e),...]; edge e from row r to fixed node j
+        self.blocks		= []		# [(offset,component),...]
+        for part in parts:
+            offset		= len( self.nodes )
+            self.blocks.append( ( offset, part ))
+            self.nodes.extend( part.nodes )
+            self.outer.extend( ( offset + a, j, e ) for a,j,e in part.outer )
+        self.lu			= {}		# { h: factors, ... }, for the network's generation
+        self.generation		= None
+
+    def factor( self, net, h ):
+        if self.generation != net.generation or len( self.lu ) >= 8:
+            self.lu		= {}
+            self.generation	= net.generation
+        lp, lc, lf		= array.array( 'i', [ 0 ] ), array.array( 'i' ), array.array( 'd' )
+        up, uc, uf		= array.array( 'i', [ 0 ] ), array.array( 'i' ), array.array( 'd' )
+        inv			= array.array( 'd' )
+        for offset,part in self.blocks:
+            A			= part.factor( net, h )
+            n			= len( A )
+            for r in range( n ):
+                row		= A[r]
+                for c in range( r ):
+                    if row[c]:
+                        lc.append( offset + c )
+                        lf.append( row[c] )
+                lp.append( len( lc ))
+                inv.append( 1 / row[r] )
+                for c in range( r + 1, n ):
+                    if row[c]:
+                        uc.append( offset + c )
+                        uf.append( row[c] / row[r] )
+                up.append( len( uc ))
+        self.lu[h]		= ( lp, lc, lf, up, uc, uf, inv )
+
+    def solve( self, net, h ):
+        T, C, Q, UA		= net.T, net.C, net.Q, net.UA
+        x			= [ C[i] / h * T[i] + Q[i] for i in self.nodes ]
+        for r,j,e in self.outer:
+            x[r]	       += UA[e] * T[j]
+        lp, lc, lf, up, uc, uf, inv = self.lu[h]
+        for r in range( len( x )):
+            v			= x[r]
+            for k in range( lp[r], lp[r+1] ):
+                v	       -= lf[k] * x[lc[k]]
+            x[r]		= v
+        for r in range( len( x ) - 1, -1, -1 ):
+            v			= x[r] * inv[r]
+            for k in range( up[r], up[r+1] ):
+                v	       -= uf[k] * x[uc[k]]
+            x[r]		= v
+        for i,v in zip( self.nodes, x ):
+            T[i]		= v
+
+
+def solve( net, stack, h, generation ):
+    # Step the stacked system by h hours, first factoring it (if not yet, for h and generation).
+    if stack.generation != generation or h not in stack.lu:
+        stack.factor( net, h )
+    stack.solve( net, h )
+
+
+def worker( conn, net, parts ):
+    # Step the given components each time an (h,generation) is received, until None.  The network's
+    # C, T, Q and UA are shared with the stepping process; only the (stacked) factors are local.
+    stack			= system( net, parts )
+    for h,generation in iter( conn.recv, None ):
+        net.generation		= generation
+        solve( net, stack, h, generation )
+        conn.send( True )
@@ -0,0 +1,86 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+#
+# Hydronic heat plant.  A single heat source (boiler or heat pump) supplies hot water to a number of
+# zone loops, each with its own circulator pump.  Each loop asks for some BTU/h (eg. its PID
+# controller's output, scaled); the loop can deliver at most what its flow rate can carry across the
+# difference between the plant's supply temperature and its zone's water (return) temperature.  The
+# plant's total output is limited; it is shared out by priority group (lowest group first), and
+# pro-rata amongst loops of the same group if it cannot satisfy them all.
+#
+# Water carries 500 BTU/h per GPM per degree F (8.33 lb/gal * 60 min/h * 1 BTU/lb/F).
+#
+BTU_h_GPM_F			= 500.
+
+
+class loop( object ):
+    __slots__			= ( 'zone', 'gpm', 'group', 'demand', 'water', 'output', 'ret' )
+
+    def __init__( self, zone, gpm, group = 0 ):
+        self.zone		= zone		# The 'zone #' water volume this loop heats
+        self.gpm		= gpm		# Circulator flow rate
+        self.group		= group		# Priority group; lower numbers are supplied first
+        self.demand		= 0.		# BTU/h requested (eg. by PID controller)
+        self.water		= 0.		# Zone water temperature (F) returning to plant
+        self.output		= 0.		# BTU/h actually delivered to the zone
+        self.ret		= 0.		# Return temperature (F) leaving the zone
+
+    def limit( self, supply ):
+        # The most this loop's flow can carry into its zone, at the given supply temperature
+        return max( 0., BTU_h_GPM_F * self.gpm * ( supply - self.water ))
+
+
+class plant( object ):
+    # A boiler (efficiency < 1.0) or heat pump (efficiency is its COP) with a maximum output
+    # 'capacity' in BTU/h, supplying water at up to 'supply' degrees F.
+    def __init__( self, capacity, supply, efficiency = 1.0 ):
+        self.capacity		= capacity
+        self.supply		= supply
+        self.efficiency		= efficiency
+        self.loops		= []		# Ordered by priority group
+        self.groups		= []		# [(group,[loop,...]),...], in priority order
+        self.output		= 0.		# Total BTU/h delivered, and consumed
+        self.input		= 0.
+
+    def supplies( self, zone, gpm, group = 0 ):
+        l			= loop( zone, gpm, group )
+        self.loops.append( l )
+        self.prioritize()
+        return l
+
+    def prioritize( self, groups = None ):
+        # Assign (optional) new priority groups from a { zone: group } dict, and (re)compute the
+        # supply order.  Done only when the plant configuration changes, never per step.
+        if groups:
+            for l in self.loops:
+                l.group		= groups.get( l.zone, l.group )
+        self.loops.sort( key = lambda l: l.group )
+        self.groups		= []
+        for l in self.loops:
+            if not self.groups or self.groups[-1][0] != l.group:
+                self.groups.append( ( l.group, [] ))
+            self.groups[-1][1].append( l )
+
+    def run( self ):
+        # Distribute the plant's capacity to each loop's (flow limited) demand, in priority group
+        # order.  Each loop's .demand and .water must already be up to date; computes each loop's
+        # .output and .ret, and the plant's total .output and (fuel/electrical) .input.
+        remains			= self.capacity
+        for _,group in self.groups:
+            wanted		= 0.
+            for l in group:
+                l.output	= max( 0., min( l.demand, l.limit( self.supply )))
+                wanted	       += l.output
+            if wanted > remains:
+                share		= remains / wanted if wanted > 0 else 0.
+                for l in group:
+                    l.output   *= share
+                wanted		= remains
+            remains	       -= wanted
+        self.output		= self.capacity - remains
+        self.input		= self.output / self.efficiency
+        for l in self.loops:
+            l.ret		= self.supply - l.output / ( BTU_h_GPM_F * l.gpm ) if l.gpm > 0 else l.water
+        return self.output
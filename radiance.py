@@ -0,0 +1,73 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import array
+
+from hydronic import environment
+
+#
+# Area-weighted mean radiant temperature of every space, as one sparse matrix-vector product.
+#
+#     A space's mean radiant temperature is the area weighted average of the surface temperatures of
+# its portals, each facing it.  A portal's surface temperature depends only on its R values (incl.
+# its films) and the temperatures of the spaces on either side; it is an affine function of them:
+#
+#     surface = a * inside + b * outside + c
+#
+# The coefficients of each portal are found once, by evaluating its temperature at a few probe
+# temperatures.  Since the portals' areas never change either, the weights of every space's
+# temperature in each space's mean radiant temperature are combined once, into a sparse (CSR) matrix
+# M (and constant k); each step, the mean radiant temperatures are simply M . T + k, for the vector T
+# of the spaces' current temperatures.  A space without portals radiates its own temperature.
+#
+def surface( portal ):
+    # The (a,b,c) coefficients of a portal's surface temperature
+    lo, hi			= environment( 0. ), environment( 100. )
+    c				= portal.temperature( inside=lo, outside=lo )
+    a				= ( portal.temperature( inside=hi, outside=lo ) - c ) / 100.
+    b				= ( portal.temperature( inside=lo, outside=hi ) - c ) / 100.
+    return a, b, c
+
+
+class radiance( object ):
+    def __init__( self, spaces, names, portals, objects, areas, space_portals ):
+        # For spaces (by index) 'names', each with its 'space_portals' slots (of portal keys, portal
+        # objects and areas) from the perspective of that space.
+        index			= dict( ( s, i ) for i,s in enumerate( names ))
+        self.nodes		= [ spaces[s].conditions for s in names ]
+        self.T			= array.array( 'd', [ 0. ] * len( names ))
+        self.start		= array.array( 'i', [ 0 ] )	# row i is col/weight[start[i]:start[i+1]]
+        self.col		= array.array( 'i' )
+        self.weight		= array.array( 'd' )
+        self.const		= array.array( 'd' )
+        for i in range( len( names )):
+            slots		= space_portals[i]
+            total		= sum( areas[j] for j in slots )
+            weights		= {}
+            k			= 0.
+            if total > 0:
+                for j in slots:
+                    a, b, c	= surface( objects[j] )
+                    w		= areas[j] / total
+                    o		= index[portals[j][1]]
+                    weights[i]	= weights.get( i, 0. ) + w * a
+                    weights[o]	= weights.get( o, 0. ) + w * b
+                    k	       += w * c
+            else:
+                weights[i]	= 1.
+            for o in sorted( weights ):
+                self.col.append( o )
+                self.weight.append( weights[o] )
+            self.start.append( len( self.col ))
+            self.const.append( k )
+
+    def compute( self, radiant ):
+        # Compute every space's mean radiant temperature (F) into the 'radiant' array
+        T, col, weight, start	= self.T, self.col, self.weight, self.start
+        for n,cond in enumerate( self.nodes ):
+            T[n]		= cond.temperature
+        for i,k in enumerate( self.const ):
+            for x in range( start[i], start[i+1] ):
+                k	       += weight[x] * T[col[x]]
+            radiant[i]		= k
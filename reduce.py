@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+import logging
+import optparse
+import time
+
+from network import network, capacity
+
+import calibrate
+import simulator
+
+#
+# Reduced-order RC models, for fast control and forecasting.
+#
+#     The full model of each zone has its spaces, a floor per space, a slab and a water volume, plus
+# every wall, roof, door and window portal.  Each zone is reduced to a two node RC network; an air
+# node 'a' (the zone's spaces) and a mass node 'm' (its floors, slab and water), which is heated:
+#
+#     Ca dTa/dt = UAao ( To - Ta ) + UAam ( Tm - Ta )
+#     Cm dTm/dt = Q    + UAam ( Ta - Tm ) + UAmg ( Tg - Tm )
+#
+# where To and Tg are the outdoor and ground temperatures, and Q the heat (BTU/h) delivered to the
+# zone's water.  The initial parameters are simply the full model's aggregated capacities and
+# conductances.  They are then fitted (using the calibration optimizer) to match the full model's
+# responses of the zone's (primary) space temperature to a step in each of Q, To and Tg.
+#
+#     The reduced model is discretized exactly (zero-order hold) for a given step size, once; each
+# step of a forecast is then a 2x2 matrix-vector product plus the inputs' contribution, so many
+# thousands of forecasts can be evaluated per second.
+#
+HOUR				= 60 * 60
+
+
+def expm( M ):
+    # The matrix exponential of a (small) square matrix, by scaling and squaring a Taylor series.
+    n				= len( M )
+    norm			= max( sum( abs( v ) for v in row ) for row in M )
+    squarings			= 0
+    while norm > .5:
+        norm		       /= 2
+        squarings	       += 1
+    A				= [ [ v / 2 ** squarings for v in row ] for row in M ]
+    E				= [ [ float( r == c ) for c in range( n ) ] for r in range( n ) ]
+    term			= [ row[:] for row in E ]
+    for k in range( 1, 16 ):
+        term			= [ [ sum( term[r][i] * A[i][c] for i in range( n )) / k for c in range( n ) ]
+                                    for r in range( n ) ]
+        E			= [ [ E[r][c] + term[r][c] for c in range( n ) ] for r in range( n ) ]
+    for _ in range( squarings ):
+        E			= [ [ sum( E[r][i] * E[i][c] for i in range( n )) for c in range( n ) ]
+                                    for r in range( n ) ]
+    return E
+
+
+class rc( object ):
+    PARAMETERS			= ( 'Ca', 'Cm', 'UAao', 'UAam', 'UAmg' )
+
+    def __init__( self, Ca, Cm, UAao, UAam, UAmg ):
+        self.Ca, self.Cm	= Ca, Cm	# BTU/F
+        self.UAao, self.UAam	= UAao, UAam	# BTU/h/F
+        self.UAmg		= UAmg
+        self.step		= None
+
+    def parameters( self ):
+        return dict( ( p, getattr( self, p )) for p in self.PARAMETERS )
+
+    def discretize( self, step ):
+        # Exactly discretize for steps of 'step' seconds: x' = Ad . x + Bd . u, for state x = (Ta,Tm)
+        # and inputs u = (Q,To,Tg).  Uses exp( [[A,B],[0,0]] h ) = [[Ad,Bd],[0,I]].
+        h			= step / HOUR
+        Ca, Cm			= self.Ca, self.Cm
+        M			= [ [ -( self.UAao + self.UAam ) / Ca, self.UAam / Ca, 0., self.UAao / Ca, 0. ],
+                                    [ self.UAam / Cm, -( self.UAam + self.UAmg ) / Cm, 1 / Cm, 0., self.UAmg / Cm ],
+                                    [ 0. ] * 5, [ 0. ] * 5, [ 0. ] * 5 ]
+        E			= expm( [ [ v * h for v in row ] for row in M ] )
+        self.Ad			= [ E[0][:2], E[1][:2] ]
+        self.Bd			= [ E[0][2:], E[1][2:] ]
+        self.step		= step
+        return self
+
+    def forecast( self, Ta, Tm, Q, To, Tg, steps ):
+        # Forecast the air temperature (F) at each of 'steps' steps from state (Ta,Tm), for constant
+        # inputs Q (BTU/h), To and Tg (F).  Also returns the final mass temperature.
+        ( a00, a01 ), ( a10, a11 ) = self.Ad
+        ( b00, b01, b02 ), ( b10, b11, b12 ) = self.Bd
+        ua			= b00 * Q + b01 * To + b02 * Tg
+        um			= b10 * Q + b11 * To + b12 * Tg
+        temps			= []
+        for _ in range( steps ):
+            Ta, Tm		= a00 * Ta + a01 * Tm + ua, a10 * Ta + a11 * Tm + um
+            temps.append( Ta )
+        return temps, Tm
+
+
+def members( z ):
+    # The full model's air and mass spaces of zone 'z'
+    air				= list( simulator.zone[z] )
+    mass			= [ z.replace( 'zone', s ) for s in air ] + [ z.replace( 'zone', 'slab' ), z ]
+    return air, mass
+
+
+def state( site, z ):
+    # The capacity weighted (Ta,Tm) of zone 'z' of the site's full model
+    def mean( names ):
+        cs			= [ ( capacity( site.spaces[n] ), site.spaces[n].conditions.temperature )
+                                    for n in names if n in site.spaces ]
+        return sum( c * t for c,t in cs ) / sum( c for c,_ in cs )
+    return tuple( mean( names ) for names in members( z ))
+
+
+class reducer( object ):
+    # Reduces each zone of a site's full model, by matching its step responses.
+    def __init__( self, site, step = 5 * 60, hours = 72, rise = 10. ):
+        self.site		= site
+        self.step		= step
+        self.count		= int( hours * HOUR // step )
+        self.rise		= rise		# F; size of each step (and heat step's steady rise)
+        self.net		= network()
+        self.net.add( site.spaces )
+
+    def initial( self, z ):
+        # The full model's aggregated capacities and conductances of zone 'z'
+        net			= self.net
+        air, mass		= ( set( net.index[n] for n in names if n in net.index )
+                                    for names in members( z ))
+        params			= dict( ( p, 0. ) for p in rc.PARAMETERS )
+        params['Ca']		= sum( net.C[i] for i in air )
+        params['Cm']		= sum( net.C[i] for i in mass )
+        for e in range( len( net.UA )):
+            ends		= set( ( net.ei[e], net.ej[e] ))
+            inside		= ends & ( air | mass )
+            if ends & air and ends & mass:
+                params['UAam'] += net.UA[e]
+            elif len( inside ) == 1 and inside & air:
+                params['UAao'] += net.UA[e]
+            elif len( inside ) == 1 and inside & mass:
+                params['UAmg'] += net.UA[e]
+        return params
+
+    def responses( self, z, substeps = 5 ):
+        # The full model's zone (primary) space temperature change (F) at each step, after a step in
+        # each of the outdoor and ground temperature, and the zone's heat (sized to raise the zone
+        # roughly as much, at steady state).  The full model is stepped more finely than the reduced.
+        net			= self.net
+        T, Q			= net.T, net.Q
+        primary			= net.index[self.site.cntrl[z][0]]
+        initial			= self.initial( z )
+        heat			= self.rise * ( initial['UAao'] + initial['UAmg'] )
+        result			= []
+        for q,dto,dtg in ( ( heat, 0., 0. ), ( 0., self.rise, 0. ), ( 0., 0., self.rise )):
+            for i in range( len( T )):
+                T[i], Q[i]	= 0., 0.
+            Q[net.index[z]]	= q
+            T[net.index['world']], T[net.index['ground']] = dto, dtg
+            temps		= []
+            for _ in range( self.count ):
+                for _ in range( substeps ):
+                    net.step( self.step / substeps )
+                temps.append( T[primary] )
+            result.append( ( ( q, dto, dtg ), temps ))
+        return result
+
+    def reduce( self, z, **kwds ):
+        # Fit zone 'z's reduced model; returns the rc model (discretized for the step), and its RMS
+        # error (F) over the step responses.  Any zero parameter (eg. no ground) is not fitted.
+        responses		= self.responses( z )
+        initial			= self.initial( z )
+        fixed			= dict( ( p, v ) for p,v in initial.items() if v <= 0 )
+        def error( params ):
+            model		= rc( **dict( fixed, **params )).discretize( self.step )
+            sse			= 0.
+            for u,temps in responses:
+                forecast,_	= model.forecast( 0., 0., u[0], u[1], u[2], self.count )
+                sse	       += sum( ( f - t ) ** 2 for f,t in zip( forecast, temps ))
+            return ( sse / ( len( responses ) * self.count )) ** .5
+        rms, params		= calibrate.optimize(
+            dict( ( p, v ) for p,v in initial.items() if v > 0 ), evaluate=error, **kwds )
+        return rc( **dict( fixed, **params )).discretize( self.step ), rms
+
+
+def load( path, step = 5 * 60 ):
+    # Load the reduced models, { zone: rc, ... }, discretized for the given step
+    with open( path ) as f:
+        models			= json.load( f )
+    return dict( ( z, rc( **dict( ( p, m[p] ) for p in rc.PARAMETERS )).discretize( step ))
+                 for z,m in models.items() )
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option( '-o', '--output', dest='output',
+                       default='reduced.json',
+                       help='Reduced models file to write (default: reduced.json)' )
+    parser.add_option( '-s', '--step', dest='step',
+                       type="float", default=5. * 60,
+                       help='Reduced model step, in seconds (default: 300)' )
+    parser.add_option( '-H', '--hours', dest='hours',
+                       type="float", default=72.,
+                       help='Hours of step response to match (default: 72)' )
+    parser.add_option( '-n', '--population', dest='population',
+                       type="int", default=32,
+                       help='Candidate parameter sets per iteration (default: 32)' )
+    parser.add_option( '-i', '--iterations', dest='iterations',
+                       type="int", default=30,
+                       help='Maximum iterations (default: 30)' )
+    (options, args) = parser.parse_args()
+
+    site			= simulator.building( simulator.now, name='reduce' )
+    red				= reducer( site, step=options.step, hours=options.hours )
+    models			= {}
+    for z in sorted( site.cntrl ):
+        model, rms		= red.reduce( z, population=options.population, iterations=options.iterations )
+        models[z]		= dict( model.parameters(), rms=rms * 5 / 9 )
+        logging.info( "%s: %s; RMS error % 7.3fC" % ( z, ', '.join(
+            "%s=%.4g" % ( p, getattr( model, p )) for p in rc.PARAMETERS ), rms * 5 / 9 ))
+
+        # Benchmark a day's forecasts from the zone's current state
+        Ta, Tm			= state( site, z )
+        Q			= simulator.heat['capacity'] / len( site.cntrl )
+        steps			= int( 24 * HOUR // options.step )
+        begun			= time.time()
+        count			= 0
+        while time.time() - begun < .5:
+            model.forecast( Ta, Tm, Q, site.world.conditions.temperature,
+                            site.ground.conditions.temperature, steps )
+            count	       += 1
+        logging.info( "%s: %d %d-step forecasts/s" % ( z, count / ( time.time() - begun ), steps ))
+
+    with open( options.output, 'w' ) as f:
+        json.dump( models, f, indent=4, sort_keys=True )
+    logging.info( "Wrote %s" % options.output )
@@ -0,0 +1,168 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import socket
+import struct
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+#
+# Modbus/TCP register server, exposing simulated points to building controllers (hardware in the
+# loop), or to any local stand-in client.
+#
+#     Input registers (function 4) hold every published point (eg. space, slab and zone temperatures
+# in tenths of a degree C) as signed 16-bit values.  They are encoded into a single big-endian image
+# once per step (refresh), and each read simply returns a slice of the current image; any number of
+# polling clients cost nothing more than the socket I/O, and never contend with the simulation.
+#
+#     Holding registers (function 3 to read, 6 and 16 to write) are writable commands (eg. each
+# zone's heat call, in tenths of a percent); a value of -1 (0xFFFF) releases the command, returning
+# control to the simulation.  The simulation reads the decoded commands once per step (command).
+#
+#     A server may serve one image (on any unit id), or several by unit id (eg. one per campus site);
+# a request for any other unit id is answered with a gateway target failed to respond exception.
+#
+RELEASE				= -1
+
+ILLEGAL_FUNCTION		= 1
+ILLEGAL_ADDRESS			= 2
+ILLEGAL_VALUE			= 3
+GATEWAY_TARGET			= 11
+
+
+class image( object ):
+    def __init__( self, inputs, holdings, scale = 10 ):
+        self.inputs		= list( inputs )	# [name,...]; address is index
+        self.holdings		= list( holdings )
+        self.index		= dict( ( n, i ) for i,n in enumerate( self.holdings ))
+        self.scale		= scale
+        self.encoding		= struct.Struct( '>%dh' % len( self.inputs ))
+        self.input		= self.encoding.pack( *( [ 0 ] * len( self.inputs )))
+        self.holding		= [ RELEASE ] * len( self.holdings )
+        self.lock		= threading.Lock()	# Serializes holding register writes
+
+    def clamp( self, value ):
+        return max( -32768, min( 32767, int( round( value * self.scale ))))
+
+    def refresh( self, values ):
+        # Encode the new values (in the order of the inputs) into a new image, replacing the old.
+        self.input		= self.encoding.pack( *[ self.clamp( v ) for v in values ])
+
+    def command( self, name ):
+        # Returns the named holding register's commanded value, or None if released.
+        v			= self.holding[self.index[name]]
+        return None if v == RELEASE else v / self.scale
+
+    def read_input( self, address, count ):
+        if address < 0 or count < 1 or address + count > len( self.inputs ):
+            raise IndexError( "input registers %d-%d" % ( address, address + count - 1 ))
+        return self.input[address*2:(address+count)*2]
+
+    def read_holding( self, address, count ):
+        if address < 0 or count < 1 or address + count > len( self.holdings ):
+            raise IndexError( "holding registers %d-%d" % ( address, address + count - 1 ))
+        return struct.pack( '>%dh' % count, *self.holding[address:address+count] )
+
+    def write_holding( self, address, values ):
+        if address < 0 or not values or address + len( values ) > len( self.holdings ):
+            raise IndexError( "holding registers %d-%d" % ( address, address + len( values ) - 1 ))
+        with self.lock:
+            self.holding[address:address+len( values )] = values
+        logging.info( "Modbus write: %s" % ( ', '.join(
+            "%s = %s" % ( self.holdings[address+i], "(released)" if v == RELEASE else v / self.scale )
+            for i,v in enumerate( values ))))
+
+
+class handler( socketserver.BaseRequestHandler ):
+    def recv( self, size ):
+        data			= b''
+        while len( data ) < size:
+            more		= self.request.recv( size - len( data ))
+            if not more:
+                raise EOFError( "connection closed" )
+            data	       += more
+        return data
+
+    def handle( self ):
+        self.request.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+        try:
+            while True:
+                tid, pid, length, uid = struct.unpack( '>HHHB', self.recv( 7 ))
+                pdu		= self.recv( length - 1 )
+                if pid != 0:
+                    continue
+                regs		= self.server.unit( uid )
+                if regs is None:
+                    function	= ord( pdu[0:1] ) if pdu else 0
+                    reply	= struct.pack( '>BB', function | 0x80, GATEWAY_TARGET )
+                else:
+                    reply	= self.process( pdu, regs )
+                self.request.sendall( struct.pack( '>HHHB', tid, 0, len( reply ) + 1, uid ) + reply )
+        except ( EOFError, socket.error ) as exc:
+            logging.debug( "Modbus client %s: %s" % ( self.client_address, exc ))
+
+    def process( self, pdu, regs ):
+        if not pdu:
+            return struct.pack( '>BB', 0x80, ILLEGAL_VALUE )
+        function		= ord( pdu[0:1] )
+        try:
+            if function in ( 3, 4 ):
+                address, count	= struct.unpack( '>HH', pdu[1:5] )
+                if not 1 <= count <= 125:
+                    return struct.pack( '>BB', function | 0x80, ILLEGAL_VALUE )
+                data		= ( regs.read_holding if function == 3 else regs.read_input )( address, count )
+                return struct.pack( '>BB', function, len( data )) + data
+            if function == 6:
+                address, value	= struct.unpack( '>Hh', pdu[1:5] )
+                regs.write_holding( address, [ value ] )
+                return pdu[0:5]
+            if function == 16:
+                address, count, size = struct.unpack( '>HHB', pdu[1:6] )
+                if not 1 <= count <= 123 or size != count * 2 or len( pdu ) < 6 + size:
+                    return struct.pack( '>BB', function | 0x80, ILLEGAL_VALUE )
+                regs.write_holding( address, list( struct.unpack( '>%dh' % count, pdu[6:6+size] )))
+                return pdu[0:5]
+        except IndexError as exc:
+            logging.debug( "Modbus function %d: %s" % ( function, exc ))
+            return struct.pack( '>BB', function | 0x80, ILLEGAL_ADDRESS )
+        except struct.error:
+            return struct.pack( '>BB', function | 0x80, ILLEGAL_VALUE )
+        return struct.pack( '>BB', function | 0x80, ILLEGAL_FUNCTION )
+
+
+class server( socketserver.ThreadingMixIn, socketserver.TCPServer ):
+    daemon_threads		= True
+    allow_reuse_address		= True
+
+    def __init__( self, address, images ):
+        # Serve an image on any unit id, or a { unit id: image, ... } on only those unit ids
+        socketserver.TCPServer.__init__( self, address, handler )
+        self.images		= images if isinstance( images, dict ) else None
+        self.image		= None if isinstance( images, dict ) else images
+
+    def unit( self, uid ):
+        return self.image if self.images is None else self.images.get( uid )
+
+
+def serve( addr, regs ):
+    # Start serving the image's (or the { unit id: image, ... }) registers on addr in a background
+    # (daemon) thread.
+    srv				= server( addr, regs )
+    thr				= threading.Thread( target=srv.serve_forever, name="modbus %s:%d" % addr )
+    thr.daemon			= True
+    thr.start()
+    units			= sorted( regs.items() ) if isinstance( regs, dict ) else [ ( None, regs ) ]
+    for uid,img in units:
+        unit			= "" if uid is None else " (unit %3d)" % uid
+        for a,n in enumerate( img.inputs ):
+            logging.info( "Modbus input   register %5d%s: %s" % ( a, unit, n ))
+        for a,n in enumerate( img.holdings ):
+            logging.info( "Modbus holding register %5d%s: %s" % ( a, unit, n ))
+    logging.info( "Serving Modbus/TCP on %s:%d" % ( addr[0] or '*', addr[1] ))
+    return srv
@@ -0,0 +1,132 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import math
+
+#
+# Streaming model-vs-sensor residual monitor.
+#
+#     Whenever a sensor's measured temperature replaces a space's computed temperature, the
+# residual (measured - computed, F) is a free measure of the error of the thermodynamic model (or of
+# the sensor).  Each sensor's residuals are tracked with O(1) state, updated in a few arithmetic
+# operations per sample (no history is kept):
+#
+#   mean/var: the exponentially weighted moving average (and variance) of the residual
+#   hi/lo:    two-sided CUSUMs of the residual, less an allowed 'slack'; a sustained bias in either
+#             direction accumulates until it exceeds 'limit'
+#   changed:  when the measured value last changed (and when it was last valid)
+#
+# Alerts are raised (and logged) only when a sensor's condition changes:
+#
+#   failed:   the sensor has supplied no valid value for 'timeout' seconds
+#   stuck:    the sensor's value has not changed for 'stuck' seconds, while the model's has
+#   drifting: a CUSUM has exceeded its limit; the sensor (or its space's model) is drifting
+#   diverged: the model; over half the sensors have an EWMA residual beyond 'diverge'
+#
+STUCK				= 'stuck'
+FAILED				= 'failed'
+DRIFTING			= 'drifting'
+DIVERGED			= 'diverged'
+
+
+class probe( object ):
+    __slots__			= ( 'name', 'count', 'mean', 'var', 'hi', 'lo', 'measured', 'computed',
+                                    'changed', 'valid', 'diverging', 'alerts' )
+
+    def __init__( self, name ):
+        self.name		= name
+        self.count		= 0
+        self.mean		= 0.		# EWMA of residual (F)
+        self.var		= 0.		# EWMA of residual variance (F^2)
+        self.hi			= 0.		# CUSUMs of positive and negative residual
+        self.lo			= 0.
+        self.measured		= None		# Last measured/computed values, and when
+        self.computed		= None
+        self.changed		= None		#   the measured value last changed
+        self.valid		= None		#   a valid value was last measured
+        self.diverging		= False		# EWMA residual beyond monitor's diverge
+        self.alerts		= set()
+
+    def std( self ):
+        return math.sqrt( self.var )
+
+
+class monitor( object ):
+    def __init__( self, alpha = .05, slack = .25, limit = 5., stuck = 2 * 60 * 60,
+                  timeout = 15 * 60, diverge = 3.6 ):
+        self.alpha		= alpha		# EWMA weight of each new sample
+        self.slack		= slack		# CUSUM allowance, F/sample
+        self.limit		= limit		# CUSUM alarm threshold, F
+        self.stuck		= stuck		# seconds unchanged before stuck
+        self.timeout		= timeout	# seconds invalid before failed
+        self.diverge		= diverge	# EWMA residual (F) indicating model divergence
+        self.probes		= {}		# { name: probe, ... }
+        self.diverging		= 0		# Count of probes with EWMA residual beyond diverge
+        self.alerts		= set()		# Model alerts
+
+    def probe( self, name ):
+        p			= self.probes.get( name )
+        if p is None:
+            p = self.probes[name]= probe( name )
+        return p
+
+    def alert( self, p, kind, active ):
+        # Raise/clear a probe's (or, if p is None, the model's) alert, logging only changes.
+        alerts			= self.alerts if p is None else p.alerts
+        if active == ( kind in alerts ):
+            return
+        if active:
+            alerts.add( kind )
+        else:
+            alerts.discard( kind )
+        ( logging.warning if active else logging.info )( "%s %s%s" % (
+            "Model" if p is None else "Sensor %s" % p.name, "" if active else "no longer ", kind ))
+
+    def sample( self, name, computed, measured, now ):
+        # Record a sensor's measured (F, or None if invalid) and the model's computed temperature.
+        p			= self.probe( name )
+        if measured is None:
+            if p.valid is None:
+                p.valid		= now
+            self.alert( p, FAILED, now - p.valid >= self.timeout )
+            return p
+        p.valid			= now
+        self.alert( p, FAILED, False )
+
+        if p.changed is None or measured != p.measured:
+            p.changed		= now
+            self.alert( p, STUCK, False )
+        elif computed != p.computed:
+            self.alert( p, STUCK, now - p.changed >= self.stuck )
+        p.measured, p.computed	= measured, computed
+
+        r			= measured - computed
+        if p.count:
+            d			= r - p.mean
+            p.mean	       += self.alpha * d
+            p.var		= ( 1 - self.alpha ) * ( p.var + self.alpha * d * d )
+        else:
+            p.mean		= r
+        p.count		       += 1
+        p.hi			= max( 0., p.hi + r - self.slack )
+        p.lo			= max( 0., p.lo - r - self.slack )
+        self.alert( p, DRIFTING, p.hi > self.limit or p.lo > self.limit )
+
+        # Maintain the count of diverging probes incrementally, rather than re-scanning them all
+        diverging		= abs( p.mean ) > self.diverge
+        if diverging != p.diverging:
+            p.diverging		= diverging
+            self.diverging     += 1 if diverging else -1
+        self.alert( None, DIVERGED, self.diverging * 2 > len( self.probes ))
+        return p
+
+    def state( self ):
+        # The JSON-able state of every probe, and the model's alerts; temperature differences in C.
+        return dict(
+            alerts	= sorted( self.alerts ),
+            sensors	= dict( ( n, dict( mean=p.mean * 5 / 9, std=p.std() * 5 / 9,
+                                           cusum=max( p.hi, p.lo ) * 5 / 9, samples=p.count,
+                                           alerts=sorted( p.alerts )))
+                                for n,p in self.probes.items() ))
@@ -0,0 +1,181 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import array
+import datetime
+import logging
+import time
+
+from hydronic import daytime
+from network import network
+from plant import BTU_h_GPM_F
+
+#
+# Occupancy setpoint schedules, with optimal start.
+#
+#     Each scheduled space has weekly occupied hours (eg. [ ( 'Mon-Fri', '08:00', '16:00' ) ]) and
+# holidays (eg. [ '2025-12-25' ]).  These are compiled once into a table of the week's time slots
+# (15 minutes, by default); whether each slot is occupied, and how many slots remain until the next
+# occupied slot.  Whether a space is occupied at any (simulated) time, or when it next will be, is
+# then a single table lookup.
+#
+#     When occupied, a space's setpoint is its occupied temperature; otherwise, it is set back to its
+# unoccupied temperature.  The setpoint (site.temp) is only changed when the space's mode changes,
+# so a manual adjustment holds until the next change.
+#
+#     Optimal start: once each (simulated) day, the site's lumped RC network is rolled forward from
+# its current state, at large implicit steps, to find how long before each zone's next occupancy its
+# heat must be started to reach the occupied setpoint in time.  The outdoor and soil temperatures
+# are assumed to remain as they are.  During the setback, each zone holds its unoccupied setpoint.
+# This is a few milliseconds of computation per day; the per-step cost is just the table lookups.
+#
+DAYS				= ( 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun' )
+WEEK				= 7 * 24 * 60 * 60
+
+
+def days( spec ):
+    # 'Mon-Fri' --> [0,1,2,3,4], 'Sat,Sun' --> [5,6]
+    result			= []
+    for part in spec.split( ',' ):
+        lo, _, hi		= part.strip().partition( '-' )
+        a, b			= DAYS.index( lo[:3].title() ), DAYS.index( ( hi or lo )[:3].title() )
+        result.extend( ( a + d ) % 7 for d in range( ( b - a ) % 7 + 1 ))
+    return result
+
+
+def clock( spec ):
+    # 'HH:MM' --> seconds since midnight
+    h, _, m			= spec.partition( ':' )
+    return int( h ) * 60 * 60 + int( m or 0 ) * 60
+
+
+class week( object ):
+    def __init__( self, hours, occupied, unoccupied, holidays = (), slot = 15 * 60 ):
+        self.occupied		= occupied	# F
+        self.unoccupied		= unoccupied
+        self.slot		= slot
+        dates			= ( datetime.datetime.strptime( d, '%Y-%m-%d' ).timetuple() for d in holidays )
+        self.holidays		= set( ( t.tm_year, t.tm_yday ) for t in dates )	# { (year,yday), ... }
+        slots			= WEEK // slot
+        self.occ		= bytearray( slots )	# Slot (from Mon 00:00) is occupied
+        for spec, start, end in hours:
+            for d in days( spec ):
+                for k in range( clock( start ) // slot, ( clock( end ) + slot - 1 ) // slot ):
+                    self.occ[( d * 24 * 60 * 60 // slot + k ) % slots] = 1
+        # Slots until the next occupied slot (0 if occupied); scan backwards, twice around the week
+        self.until		= array.array( 'i', [ slots ] * slots )
+        n			= None
+        for k in range( 2 * slots - 1, -1, -1 ):
+            n			= 0 if self.occ[k % slots] else None if n is None else n + 1
+            if n is not None:
+                self.until[k % slots] = min( self.until[k % slots], n )
+
+    # The local time struct 't' of 'when' may be supplied (if already known) to each of these, to
+    # avoid converting it again; eg. once per step, for every space's schedule.
+    def index( self, when, t = None ):
+        # The week's slot index of the (local) time, and the seconds into it
+        t			= t or time.localtime( when )
+        secs			= ( t.tm_wday * 24 + t.tm_hour ) * 60 * 60 + t.tm_min * 60 + t.tm_sec
+        return secs // self.slot, secs % self.slot
+
+    def holiday( self, when, t = None ):
+        t			= t or time.localtime( when )
+        return ( t.tm_year, t.tm_yday ) in self.holidays
+
+    def active( self, when, t = None ):
+        # Is the space occupied at this time?
+        t			= t or time.localtime( when )
+        k, _			= self.index( when, t )
+        return bool( self.occ[k] ) and not self.holiday( when, t )
+
+    def next( self, when ):
+        # The start of the next occupied slot at or after 'when' (skipping holidays), or None if never
+        for _ in range( 366 ):
+            k, into		= self.index( when )
+            n			= self.until[k]
+            if n >= len( self.occ ):
+                return None
+            start		= when if n == 0 else when - into + n * self.slot
+            if not self.holiday( start ):
+                return start
+            # Skip to the end of the holiday
+            t			= time.localtime( start )
+            when		= time.mktime( ( t.tm_year, t.tm_mon, t.tm_mday + 1, 0, 0, 0, 0, 0, -1 ))
+        return None
+
+
+class planner( object ):
+    # Applies the weekly schedules of a site's spaces to its setpoints, with optimal start.
+    def __init__( self, site, weeks, step = 15 * 60, lead = 12 * 60 * 60 ):
+        self.weeks		= weeks		# { space: week, ... }
+        self.step		= step		# Rollout step, and maximum lead time
+        self.lead		= lead
+        self.mode		= {}		# { space: occupied (bool), ... }
+        self.start		= {}		# { space: ( optimal start, of next occupancy ), ... }
+        self.planned		= None		# Day last planned
+        self.supply		= site.boiler.supply	# Plant supply temperature (F), as of plan
+        self.net		= network()
+        self.net.add( site.spaces )
+        idx			= self.net.index
+        self.zones		= [ ( l, idx[l.zone], idx[site.cntrl[l.zone][0]], weeks[site.cntrl[l.zone][0]] )
+                                    for l in site.boiler.loops if site.cntrl[l.zone][0] in weeks ]
+        self.nodes		= [ ( site.spaces[n].conditions, i ) for i,n in enumerate( self.net.names ) ]
+
+    def apply( self, site, now ):
+        # Set each scheduled space's setpoint whenever its mode changes (re-planning once a day).  The
+        # local time is converted just once per step, for every space's schedule.
+        t			= time.localtime( now )
+        day			= t[:3]
+        if day != self.planned:
+            self.planned	= day
+            self.plan( site, now )
+        for s,wk in self.weeks.items():
+            start, occupancy	= self.start.get( s, ( None, None ))
+            occupied		= wk.active( now, t ) or start is not None and start <= now < occupancy
+            if occupied != self.mode.get( s ):
+                self.mode[s]	= occupied
+                site.temp[s]	= wk.occupied if occupied else wk.unoccupied
+                logging.info( "%s: %s %s" % ( site.name or 'site', s,
+                                               "occupied" if occupied else "unoccupied" ))
+
+    def rollout( self, T0, until, start ):
+        # From state T0, step the network to 'until' seconds later, with each zone holding its
+        # setback until its 'start' (seconds, or None), then heating fully.  Returns the final state.
+        net			= self.net
+        T, Q			= net.T, net.Q
+        for i,t in enumerate( T0 ):
+            T[i]		= t
+        elapsed			= 0.
+        while elapsed < until:
+            for l,zi,si,wk in self.zones:
+                heat		= start.get( l.zone ) is not None and elapsed >= start[l.zone] \
+                                  or T[si] < wk.unoccupied
+                Q[zi]		= max( 0., BTU_h_GPM_F * l.gpm * ( self.supply - T[zi] )) if heat else 0.
+            net.step( self.step )
+            elapsed	       += self.step
+        return T
+
+    def plan( self, site, now ):
+        # Find each scheduled zone's latest start (by bisection over rollouts) that reaches its
+        # occupied setpoint by its next occupancy.
+        self.supply		= site.boiler.supply
+        T0			= [ cond.temperature for cond,_ in self.nodes ]
+        self.start		= {}
+        for l,zi,si,wk in self.zones:
+            s			= site.cntrl[l.zone][0]
+            occupancy		= wk.next( now )
+            if occupancy is None or occupancy - now > 2 * self.lead:
+                continue
+            steps		= int( ( occupancy - now ) // self.step )
+            lo, hi		= max( 0, steps - int( self.lead // self.step )), steps
+            while lo < hi:
+                mid		= ( lo + hi + 1 ) // 2
+                final		= self.rollout( T0, steps * self.step, { l.zone: mid * self.step } )
+                if final[si] >= wk.occupied:
+                    lo		= mid
+                else:
+                    hi		= mid - 1
+            self.start[s]	= ( now + lo * self.step, occupancy )
+            logging.info( "%s: %s heat starts %s before occupancy" % (
+                site.name or 'site', s, daytime( occupancy - self.start[s][0] )))
@@ -7,7 +7,7 @@ from __future__ import division
 import copy
 import curses, curses.ascii, curses.panel
 import itertools
-import functools
+import json
 import logging
 import math
 import optparse
@@ -21,6 +21,16 @@ from hydronic import (
     merge, BTU_ft3_F, daytime, fanger
 )
 from ownercredit import pid, misc
+from plant import plant
+from ledger import ledger
+from network import network
+import webapi
+import metrics
+import registers
+import schedule
+import residual
+from checkpoint import checkpoint
+from frame import frame
 from cpppo.dotdict import dotdict
 from cpppo import log_cfg
 
@@ -129,66 +139,18 @@ zone['zone 2']			= [ 'center' ]
 zone['zone 3']			= [ 'right' ]
 
 
-now				= misc.timer()
-
-world				= space( 'world',  ( 10000.,  10000.,   10000. ),
-                                         environment( -40. ), now = now )
-ground				= space( 'ground', ( 10000.,  10000.,   10000. ),
-                                         environment( C_to_F( 5. ), what = 'soil' ), now = now )
-world.contains( ground )
-
-spaces['world']			= world
-spaces['ground']		= ground
-
+# Temperature setpoints (and initial space temperatures), for each space (only if changed from default)
 temp				= {}
 temp['']			= C_to_F( 20.0 )
 
-for nm,sz in size.items():
-    try:    tmp			= temp[nm]
-    except: tmp			= temp['']
-    spaces[nm]			= space( nm, sz, environment( tmp ), now = now )
-    world.contains( spaces[nm] )
-
-for fo,ts in wall.items():
-    frm,out,nam                 = fo    # ( 'garage', 'world', "North" )
-    typ,siz			= ts    # ( '8"', ( 59., 9.5 ))
-    logging.info( "Wall   %10s <-> %-10s: %-6s, %-12s (%.2fft^2)" % ( frm, out, typ, dimension( siz ), area( siz )))
-    # Track down any windows/doors to the same space, and net them out of siz...
-    for nn,s in itertools.chain( door.items(), window.items() ):
-        if nn[0] == frm and out == 'world':
-            siz			= ( siz[0] - s[0]*s[1]/siz[1], siz[1] )
-            logging.info( "  - %12s (%.2fft^2) ==> %-12ss (%.2fft^2)" % ( nn[1], area( s ), dimension( siz ), area( siz )))
-    spaces[frm].connects( portal( "% 9s/%-9s Wall %s, %s" % ( frm, out, nam, typ ), out, siz, R[typ] ))
-
-# fill any any missing entries in roof.  If you specify any (portion) of a spaces's roof, you must
-# specify it all (we'll only fill in an attic roof for missing sized spaces).  We don't include any
-# 'joist' roofs here, because they are actually heated floor zones, too...
-
-for du,ts in itertools.chain(
-        roof.items(),
-        [((k,'world'),('SIP4',size[k])) for k in size.keys()
-         if k not in [ d for d,u in roof.keys() ]]
-):
-    dn,up			= du					# ( 'upstairs', 'world' )
-    typ,siz			= ts                                    # ( 'attic', ( 9.333, 39.333 ))
-    siz				= ( siz[0], siz[1] )			# tidy up any with extra z dimensions
-    if typ != 'joist':
-        logging.info( "Roof   %10s <-> %-10s: %-6s, %-12s (% 5.2fft^2)" % (
-            dn, up, typ, dimension( siz ), area( siz )))
-        spaces[dn].connects( portal( "% 9s/%-9s Roof, %s" % ( dn, up, typ ), up, siz, R[typ] ))
-
-for fn,siz in door.items():
-    frm,nam                     = fn    # ( 'garage', 'Car Right' )
-    logging.info( "Door   %10s <-> %-10s: R% 5d %-12s (% 5.2fft^2) %s" % (
-        frm, 'world', R['door'], dimension( siz ), area( siz ), nam ))
-    spaces[frm].connects( portal( "% 9s/%-9s Door %s" % ( frm, 'world', nam ), 'world', siz, R['door'] ))
-
-for fn,siz in window.items():
-    frm,nam                     = fn    # ( 'garage', 'North 1' )
-    logging.info( "Window %10s <-> %-10s: R% 5d %-12s (% 5.2fft^2) %s" % (
-        frm, 'world', R['window'], dimension( siz ), area( siz ), nam ))
-    spaces[frm].connects( portal( "% 9s/%-9s Window %s" % ( frm, 'world', nam ), 'world', siz, R['window'] ))
-
+# Occupancy schedules for each space (the '' default applies to every sized space), and holidays
+# ('YYYY-MM-DD').  When enabled (-S/--schedule), each space's setpoint is set back to its 'unoccupied'
+# temperature outside of its weekly hours, and its zone's heat started in time to reach 'occupied'.
+occupy				= {}
+occupy['']			= dict( hours		= [ ( 'Mon-Fri', '08:00', '16:00' ) ],
+                                        occupied	= C_to_F( 20.0 ),
+                                        unoccupied	= C_to_F( 16.0 ))
+holidays			= []
 
 # Is each zone in auto mode, and if so what priority group is it
 auto				= {}
@@ -253,81 +215,184 @@ temp_pid			= {	# PID loop tuning
 #            ground    (space below)
 #
 BTU_ft3_F['polyaspartic']	=  BTU_ft3_F['wood'] #?
-for zn,l in zone.items():
-    # Get the merged size of the zone in 'zs', from all spaces that share it, and create a floor for
-    # each "space" above "zone #", named "space #" Each space holds its own floor, because we want
-    # it to be shown in the details window when the space is selected.
-    covering			= 'polyaspartic'
-    zs				= None
-    floor			= []
-    for s in l:
-        zs			= merge( zs, spaces[s].size )
-
-        # Create a floor for each space, and connect it.  Name it 'space #' (matching 'zone #').
-        # This transfers heat in 2 ways into the space; radiant and convective.  We want the radiant
-        # temperature of the zone/slab/floor to represent the R value of the physical floor
-        # components.  If we set a non-zero R value for this portal, its "inside" temperature for
-        # radiant calculations will reflect the interior temperature of the space (net the film R
-        # value).  However, a thermal mass should radiate from its surface at its "internal"
-        # temperature.  So, we'll always uses R=0, and use the film R value to reflect the flooring
-        # thermal resistance.
-        fs			= resize( spaces[s].size, h = meas[covering] )
-        fn			= zn.replace( 'zone', s )
-        spaces[fn]		= space( fn, fs,
+
+
+
+# Heat plant.  A single boiler (or heat pump; use its COP as efficiency) supplies each zone's loop of
+# 1/2" PEX.  Each zone's PID controller output (scaled to interval['BTU']) is its demand; the
+# plant's capacity is shared out to zones by their priority group in 'auto' (lowest first).
+heat				= {}
+heat['capacity']		= 40000.		# BTU/h maximum plant output
+heat['supply']			= C_to_F( 45. )		# maximum supply water temperature
+heat['efficiency']		= .85			# output/input (boiler), or COP (heat pump)
+heat['gpm']			= .5			# GPM per (up to) 300ft^2 loop
+
+
+#
+# calibrated -- apply a calibrated building file's R and BTU_ft3_F values (see calibrate.py)
+#
+def calibrated( path ):
+    with open( path ) as f:
+        cal			= json.load( f )
+    R.update( cal.get( 'R', {} ))
+    BTU_ft3_F.update( cal.get( 'BTU_ft3_F', {} ))
+    logging.info( "Calibrated building %s: %s" % ( path, ', '.join(
+        "%s:%s=%.4f" % ( t, n, v ) for t in ( 'R', 'BTU_ft3_F' ) for n,v in sorted( cal.get( t, {} ).items() ))))
+    return cal
+
+
+#
+# building -- instantiate an independent model of the building (a "site")
+#
+#     Every space (and each zone's floors, slab and water), portal, PID controller and the heat plant
+# is created afresh from the definitions above, along with the site's own copies of the setpoints
+# (temp), comfort (fang) and automation (auto) settings.  Returns the site's model as a dotdict.
+# Only the default (unnamed) site logs the details of its construction.
+#
+def building( now, name = '', temp = temp, fang = fang, auto = auto ):
+    detail			= logging.debug if name else logging.info
+    temp			= copy.deepcopy( temp )
+    fang			= copy.deepcopy( fang )
+    auto			= copy.deepcopy( auto )
+    spaces			= {}
+    cntrl			= {}
+    kinds			= {}		# { (space,portal): (R key,film R key), ... }
+
+    def connect( s, p, r = None, film = None ):
+        # Connect the portal to space s, remembering which R values (if any) determine its R and film
+        spaces[s].connects( p )
+        kinds[(s,p.name)]	= ( r, film )
+
+    world			= space( 'world',  ( 10000.,  10000.,   10000. ),
+                                         environment( -40. ), now = now )
+    ground			= space( 'ground', ( 10000.,  10000.,   10000. ),
+                                         environment( C_to_F( 5. ), what = 'soil' ), now = now )
+    world.contains( ground )
+
+    spaces['world']		= world
+    spaces['ground']		= ground
+
+    for nm,sz in size.items():
+        try:    tmp		= temp[nm]
+        except: tmp		= temp['']
+        spaces[nm]		= space( nm, sz, environment( tmp ), now = now )
+        world.contains( spaces[nm] )
+
+    for fo,ts in wall.items():
+        frm,out,nam             = fo    # ( 'garage', 'world', "North" )
+        typ,siz			= ts    # ( '8"', ( 59., 9.5 ))
+        detail( "Wall   %10s <-> %-10s: %-6s, %-12s (%.2fft^2)" % ( frm, out, typ, dimension( siz ), area( siz )))
+        # Track down any windows/doors to the same space, and net them out of siz...
+        for nn,s in itertools.chain( door.items(), window.items() ):
+            if nn[0] == frm and out == 'world':
+                siz		= ( siz[0] - s[0]*s[1]/siz[1], siz[1] )
+                detail( "  - %12s (%.2fft^2) ==> %-12ss (%.2fft^2)" % ( nn[1], area( s ), dimension( siz ), area( siz )))
+        connect( frm, portal( "% 9s/%-9s Wall %s, %s" % ( frm, out, nam, typ ), out, siz, R[typ] ), typ )
+
+    # fill any any missing entries in roof.  If you specify any (portion) of a spaces's roof, you must
+    # specify it all (we'll only fill in an attic roof for missing sized spaces).  We don't include any
+    # 'joist' roofs here, because they are actually heated floor zones, too...
+
+    for du,ts in itertools.chain(
+            roof.items(),
+            [((k,'world'),('SIP4',size[k])) for k in size.keys()
+             if k not in [ d for d,u in roof.keys() ]]
+    ):
+        dn,up			= du					# ( 'upstairs', 'world' )
+        typ,siz			= ts                                    # ( 'attic', ( 9.333, 39.333 ))
+        siz			= ( siz[0], siz[1] )			# tidy up any with extra z dimensions
+        if typ != 'joist':
+            detail( "Roof   %10s <-> %-10s: %-6s, %-12s (% 5.2fft^2)" % (
+                dn, up, typ, dimension( siz ), area( siz )))
+            connect( dn, portal( "% 9s/%-9s Roof, %s" % ( dn, up, typ ), up, siz, R[typ] ), typ )
+
+    for fn,siz in door.items():
+        frm,nam                 = fn    # ( 'garage', 'Car Right' )
+        detail( "Door   %10s <-> %-10s: R% 5d %-12s (% 5.2fft^2) %s" % (
+            frm, 'world', R['door'], dimension( siz ), area( siz ), nam ))
+        connect( frm, portal( "% 9s/%-9s Door %s" % ( frm, 'world', nam ), 'world', siz, R['door'] ), 'door' )
+
+    for fn,siz in window.items():
+        frm,nam                 = fn    # ( 'garage', 'North 1' )
+        detail( "Window %10s <-> %-10s: R% 5d %-12s (% 5.2fft^2) %s" % (
+            frm, 'world', R['window'], dimension( siz ), area( siz ), nam ))
+        connect( frm, portal( "% 9s/%-9s Window %s" % ( frm, 'world', nam ), 'world', siz, R['window'] ), 'window' )
+
+    for zn,l in zone.items():
+        # Get the merged size of the zone in 'zs', from all spaces that share it, and create a floor for
+        # each "space" above "zone #", named "space #" Each space holds its own floor, because we want
+        # it to be shown in the details window when the space is selected.
+        covering		= 'polyaspartic'
+        zs			= None
+        floor			= []
+        for s in l:
+            zs			= merge( zs, spaces[s].size )
+
+            # Create a floor for each space, and connect it.  Name it 'space #' (matching 'zone #').
+            # This transfers heat in 2 ways into the space; radiant and convective.  We want the radiant
+            # temperature of the zone/slab/floor to represent the R value of the physical floor
+            # components.  If we set a non-zero R value for this portal, its "inside" temperature for
+            # radiant calculations will reflect the interior temperature of the space (net the film R
+            # value).  However, a thermal mass should radiate from its surface at its "internal"
+            # temperature.  So, we'll always uses R=0, and use the film R value to reflect the flooring
+            # thermal resistance.
+            fs			= resize( spaces[s].size, h = meas[covering] )
+            fn			= zn.replace( 'zone', s )
+            spaces[fn]		= space( fn, fs,
                                          environment( spaces[l[0]].conditions.temperature,
                                                       what = covering ),
                                          now = now )
-        spaces[s].contains( spaces[fn] )
-        spaces[s].connects( portal( "% 9s/%-9s Floor of %s" % ( zn, fn, s ), fn, fs, 
-                                    R=0, film=R[covering] ))
-
-
-    # Estimated piping length on 12" centers, is simply the area of zone.  1/2" sdr-9 PEX contains
-    # .92 gallons per 100. ft.  There are 231 cubic inches per gallon.  Spread over the total area
-    # of the zone, this gives us the "thickness" of the zone, in inches to yield the volume of water.
-    feet			= area( zs )
-    gallons			= feet * .92 / 100.
-    inches			= gallons * 231 / ( feet * 144 )
-
-    # Create the zone, out of water, add it to world.  Take on the temperature of the
-    # first space.  We can't contain it inside a space, because it may span several.
-    zs				= resize( zs, h = ft(0,inches))
-    spaces[zn]			= space( zn, zs,
+            spaces[s].contains( spaces[fn] )
+            connect( s, portal( "% 9s/%-9s Floor of %s" % ( zn, fn, s ), fn, fs, 
+                                R=0, film=R[covering] ), film=covering )
+
+
+        # Estimated piping length on 12" centers, is simply the area of zone.  1/2" sdr-9 PEX contains
+        # .92 gallons per 100. ft.  There are 231 cubic inches per gallon.  Spread over the total area
+        # of the zone, this gives us the "thickness" of the zone, in inches to yield the volume of water.
+        feet			= area( zs )
+        gallons			= feet * .92 / 100.
+        inches			= gallons * 231 / ( feet * 144 )
+
+        # Create the zone, out of water, add it to world.  Take on the temperature of the
+        # first space.  We can't contain it inside a space, because it may span several.
+        zs			= resize( zs, h = ft(0,inches))
+        spaces[zn]		= space( zn, zs,
                                          environment( spaces[l[0]].conditions.temperature,
                                                       what = 'water' ),
                                          now = now )
-    world.contains( spaces[zn] )
-
-    # Find any roof specifying that this space is the upper of the pair, and create portals -- both
-    # the upper slab and lower space attach to the zone.
-    mass			= 'slab'
-    what			= 'wood'
-    thick			= meas['subfloor']
-
-    # Connect the zone to the flooring system, via a slab.  We'll assume it is 'concrete', but it
-    # may be 'wood' if we've discovered that this is a "joist" zone, just above...  Note that a zone
-    # must be *all* concrete slab or joist.  The R value will be that of concrete or floor sheeting.
-    ss				= resize( zs, h = thick )
-    sn				= zn.replace( 'zone', 'slab' )
-    spaces[sn]			= space( sn, ss,
+        world.contains( spaces[zn] )
+
+        # Find any roof specifying that this space is the upper of the pair, and create portals -- both
+        # the upper slab and lower space attach to the zone.
+        mass			= 'slab'
+        what			= 'wood'
+        thick			= meas['subfloor']
+
+        # Connect the zone to the flooring system, via a slab.  We'll assume it is 'concrete', but it
+        # may be 'wood' if we've discovered that this is a "joist" zone, just above...  Note that a zone
+        # must be *all* concrete slab or joist.  The R value will be that of concrete or floor sheeting.
+        ss			= resize( zs, h = thick )
+        sn			= zn.replace( 'zone', 'slab' )
+        spaces[sn]		= space( sn, ss,
                                      environment( spaces[l[0]].conditions.temperature,
                                                   what = what ),
                                      now = now )
-    world.contains( spaces[sn] )
-    spaces[sn].connects( portal( "% 9s/%-9s Fluid" % ( zn, sn ), zn, ss,
-                                 R['subfloor'], film=0 ))
-
-    # Connect each space's floor to the (subfloor or concrete) slab.  For each 'space' connected to
-    # 'zone #', its floor is called 'space #'.  It is directly connected (film=0).
-    for s in l:
-        fn			= zn.replace( 'zone', s )
-        spaces[sn].connects( portal( "% 9s/%-9s Flooring" % ( sn, fn ), fn, spaces[s].size,
-                                     R['fluid'], film=0 ))
-
-    if mass == 'slab':
-        # The ground sees the radiant heat of a concrete slab zone via SIP panels
-        spaces[sn].connects( portal( "% 9s/%-9s Insulation" % ( sn, 'ground' ),
-                                     'ground',  ss, R['SIP4'], film=0 ))
+        world.contains( spaces[sn] )
+        connect( sn, portal( "% 9s/%-9s Fluid" % ( zn, sn ), zn, ss,
+                             R['subfloor'], film=0 ), 'subfloor' )
+
+        # Connect each space's floor to the (subfloor or concrete) slab.  For each 'space' connected to
+        # 'zone #', its floor is called 'space #'.  It is directly connected (film=0).
+        for s in l:
+            fn			= zn.replace( 'zone', s )
+            connect( sn, portal( "% 9s/%-9s Flooring" % ( sn, fn ), fn, spaces[s].size,
+                                 R['fluid'], film=0 ), 'fluid' )
+
+        if mass == 'slab':
+            # The ground sees the radiant heat of a concrete slab zone via SIP panels
+            connect( sn, portal( "% 9s/%-9s Insulation" % ( sn, 'ground' ),
+                                 'ground',  ss, R['SIP4'], film=0 ), 'SIP4' )
 
     # Create PID Controllers.  Adjusts the number of degree-minutes per hour required to keep the
     # area at a specific temperature.  Go thru each zone, and find the first zone's space that has a
@@ -336,14 +401,14 @@ for zn,l in zone.items():
     # 'zone 1': ( 'garage', pid.controller ).  Use the temperature of the first space on the zone to
     # control the entire zone.
     for z in zone.keys():
-        cntrl[z]		= (zone[z][0],None)
+        cntrl[z]	= (zone[z][0],None)
 
     # Now fill in all the pid.controllers.  The setpoint is the space's target temperature, and the
     # process value is its current temperature.  Get the saved Kpid parameters and current I value.
     for z in cntrl.keys():
-        s			= cntrl[z][0]
-        try:    t		= temp[s]
-        except: t		= temp['']
+        s		= cntrl[z][0]
+        try:    t	= temp[s]
+        except: t	= temp['']
 
         # Get a deep copy of everything (eg. the Lout list, ...), so that each controller gets its
         # own copy, and also if something changes, we can compare it with the unmodified master when
@@ -351,19 +416,415 @@ for zn,l in zone.items():
         t_pid			= copy.deepcopy( temp_pid.get( '' ))
         t_pid.update( copy.deepcopy( temp_pid.get( s, {} )))
 
-        cntrl[z]		= (s, pid.controller( t_pid['Kpid'],
-                                                      setpoint	= misc.scale( t,
-                                                                              interval['fahrenheit'],
-                                                                              interval['normal'] ),
-                                                      process	= misc.scale( spaces[s].conditions.temperature,
-                                                                              interval['fahrenheit'],
-                                                                              interval['normal'] ),
-                                                      output	= 0.,
-                                                      Lout	= t_pid['Lout'],
-                                                      now	= now ))
+        cntrl[z]	= (s, pid.controller( t_pid['Kpid'],
+                                                  setpoint	= misc.scale( t,
+                                                                          interval['fahrenheit'],
+                                                                          interval['normal'] ),
+                                                  process	= misc.scale( spaces[s].conditions.temperature,
+                                                                          interval['fahrenheit'],
+                                                                          interval['normal'] ),
+                                                  output	= 0.,
+                                                  Lout	= t_pid['Lout'],
+                                                  now	= now ))
         if 'I' in t_pid:
             cntrl[z][1].I	= t_pid['I']
 
+    boiler			= plant( heat['capacity'], heat['supply'], heat['efficiency'] )
+    for z in sorted( zone.keys() ):
+        loops			= int( math.ceil( area( spaces[z].size ) / 300. ))
+        boiler.supplies( z, gpm=heat['gpm'] * loops )
+    boiler.prioritize( auto )
+
+    site			= dotdict()
+    site.name			= name
+    site.world			= world
+    site.ground			= ground
+    site.spaces			= spaces
+    site.kinds			= kinds
+    site.cntrl			= cntrl
+    site.temp			= temp
+    site.fang			= fang
+    site.auto			= auto
+    site.boiler			= boiler
+    site.energy			= None		# ledger, created on first step
+    site.residual		= residual.monitor()	# model vs. sensor residuals
+    site.schedule		= None		# schedule.planner, if setpoints are scheduled
+    site.hil			= None		# registers.image, if serving Modbus/TCP
+    site.web			= None		# webapi.snapshot, if serving HTTP/JSON
+    site.metrics		= None		# metrics.exporter, if exporting metrics
+    site.frame			= None		# frame, of derived state; created on first derive
+    return site
+
+
+# The default site, displayed by the UI.  Its model state is also available via module globals.
+now				= misc.timer()
+site				= building( now )
+world				= site.world
+ground				= site.ground
+spaces				= site.spaces
+cntrl				= site.cntrl
+temp				= site.temp
+fang				= site.fang
+auto				= site.auto
+boiler				= site.boiler
+
+
+# Energy accounting.  Each zone's energy includes that of its spaces, their floors, its slab and its
+# water (incl. the plant's heat).  Each site's ledger is created with its first step's portals;
+# checkpointed hourly.
+energy_groups			= dict( ( z, l + [ z.replace( 'zone', s ) for s in l ]
+                                          + [ z.replace( 'zone', 'slab' ), z ] )
+                                        for z,l in zone.items() )
+
+
+# Modbus/TCP register image for hardware-in-the-loop (if serving).  Input registers are every
+# space's temperature (C x 10), followed by each zone's heat call (% x 10).  Holding registers
+# command each zone's heat call (% x 10), overriding its PID controller until released (-1).
+hil_spaces			= sorted( spaces.keys(), key=misc.natural )
+hil_zones			= sorted( zone.keys(), key=misc.natural )
+
+
+#
+# heatcall -- a zone's applied heat call (%)
+#
+#     Any heat call commanded via Modbus overrides the zone's PID controller output.
+#
+def heatcall( site, z ):
+    cmd				= site.hil.command( z ) if site.hil else None
+    if cmd is None:
+        return misc.scale( site.cntrl[z][1].value, interval['normal'], interval['percent'] )
+    return cmd
+
+
+#
+# supply -- run a site's heat plant, using each zone's demand over the last 'delta' seconds
+#
+#     The heat plant uses the *previous* time period's applied heat call (the PID controller output,
+# or any heat call commanded via Modbus) as each zone's demand in BTU/h.  Returns each zone's heat
+# delivered to its water, as a key faking up the heat added by the pumps:
+# { ('zone #','hydronic','pumps'): BTU, ... }
+#
+def supply( site, delta ):
+    spaces, boiler		= site.spaces, site.boiler
+    for l in boiler.loops:
+        l.demand		= misc.scale( heatcall( site, l.zone ),
+                                              interval['percent'], interval['BTU'] )
+        l.water			= spaces[l.zone].conditions.temperature
+    boiler.run()
+    return dict( ( (l.zone,'hydronic','pumps'), l.output * delta / 60 / 60 ) for l in boiler.loops )
+
+
+#
+# control -- run a site's PID controllers for this time period
+#
+#     Computes the next time period's BTU/hour contributions, to the (scheduled, if enabled)
+# setpoints.  Condition the input and output to be in range (0,1).  While a zone's heat call is
+# overridden via Modbus, its PID controller's integral is held, so it doesn't wind up.  Then,
+# refresh the site's Modbus/TCP registers (if serving) with the new state, incl. the applied heat
+# calls.
+#
+def control( site, now ):
+    spaces, cntrl, temp		= site.spaces, site.cntrl, site.temp
+    if site.schedule:
+        site.schedule.apply( site, now )
+    for z in cntrl.keys():
+        try:    t		= temp[cntrl[z][0]]
+        except: t		= temp['']
+        c			= cntrl[z][1]
+        held			= c.I if site.hil and site.hil.command( z ) is not None else None
+        c.loop(
+            setpoint	= misc.scale( t,
+                                          interval['fahrenheit'], interval['normal'] ),
+            process		= misc.scale( spaces[cntrl[z][0]].conditions.temperature,
+                                          interval['fahrenheit'], interval['normal'] ),
+            now		= now )
+        if held is not None:
+            c.I			= held
+
+    if site.hil:
+        site.hil.refresh( itertools.chain(
+            ( F_to_C( spaces[s].conditions.temperature ) for s in hil_spaces ),
+            ( heatcall( site, z ) for z in hil_zones )))
+
+
+#
+# step -- advance a site's thermodynamic model to 'now', 'delta' seconds since the last step
+#
+#     Computes the heat gain/loss of every space over the last time period, overrides the computed
+# temperature of any space with a working sensor, adds the heat supplied to each zone's water by the
+# heat plant, and applies (and accounts for) the net BTU gains/losses to the world.  Finally, runs
+# the PID controllers to compute the next time period's heat call.  Returns the step's results,
+# including the plant's heat (added to the computed results in place, rather than to a copy).
+#
+def step( site, now, delta ):
+    spaces			= site.spaces
+    results			= site.world.compute( now=now )
+
+    # For zones with a working slab sensor, take on its temperature.  Zones without one are
+    # simulated; their water is heated by the plant, below.
+    for z in site.cntrl.keys():
+        s			= z.replace( 'zone', 'slab' )
+        sen			= spaces[s].conditions.sensor if s in spaces else None
+        if sen:
+            with sen.lock:
+                act		= sen.compute( max( now, sen.now ))
+            if not misc.non_value( act ) and 0.0 < act < 40.0:
+                spaces[s].conditions.temperature \
+                    = spaces[z].conditions.temperature \
+                    = C_to_F( act )
+            else:
+                logging.debug( "%s == %s: Invalid sensor; ignoring" % ( s, str( act )))
+
+    results.update( supply( site, delta ))
+
+    # And finally, apply the net BTU gains/losses to the world.  This estimates the temperature
+    # conditions of every space and surface in the world.
+    site.world.absorb( results )
+    if site.energy is None:
+        site.energy		= ledger( results.keys(), energy_groups )
+    site.energy.add( results, now )
+
+    sense( site, now )
+    control( site, now )
+    return results
+
+
+#
+# sense -- any space of a site with a sensor takes on its current value
+#
+#     Uses the value's current time, 'cause it is being updated in the background, and may have a time
+# already after our own 'now' cycle.  Readings outside a plausible 0-40C are ignored, as invalid.
+# The difference from the model's computed temperature is monitored, before it is replaced.
+#
+def sense( site, now ):
+    spaces			= site.spaces
+    for s in spaces.keys():
+        sen			= spaces[s].conditions.sensor
+        if sen:
+            with sen.lock:
+                act		= sen.compute( max( now, sen.now ))
+            measured		= None
+            if not misc.non_value( act ) and 0.0 < act < 40.0:
+                measured	= C_to_F( act )
+            else:
+                logging.debug( "%s == %s: Invalid sensor; ignoring" % ( s, str( act )))
+            site.residual.sample( s, spaces[s].conditions.temperature, measured, now )
+            if measured is not None:
+                spaces[s].conditions.temperature = measured
+
+
+#
+# campus -- many independent sites, stepped together
+#
+#     Each site is its own building model (spaces, PID controllers, heat plant, setpoints), but all
+# share the same weather; every site's world and ground are a single pair of fixed boundary nodes
+# in one lumped thermal network holding all the sites' spaces.  Each step runs every site's heat
+# plant, steps the entire network's heat flow at once, and then runs every site's PID controllers.
+# The hydronic spaces' temperatures are updated from the network after each step (and any sensed
+# spaces' temperatures back into the network), and each site's step results (the BTU gained/lost via
+# each portal, from the network's edge flows) are accounted in its ledger, and kept in 'results' for
+# publishing.  So, each site's state, control, sensors, ledger, and any Modbus/JSON/metrics interfaces
+# attached to it work just as for a site stepped by step().  The first sites may be supplied (eg. the
+# default site, with its interfaces); the rest are built.
+#
+class campus( object ):
+    def __init__( self, count, now, sites = () ):
+        self.sites		= list( sites ) + [ building( now, name="site %d" % ( n + 1 ))
+                                                    for n in range( len( sites ), count ) ]
+        self.net		= network()
+        self.edges		= []		# [[(e,key,reverse key),...],...]; each site's edges
+        for st in self.sites:
+            prefix		= st.name + '/'
+            first		= len( self.net.UA )
+            self.net.add( st.spaces, prefix=prefix )
+            edges		= []
+            for e in range( first, len( self.net.UA )):
+                n, p		= self.net.keys[e]
+                onto		= self.net.names[self.net.ej[e]]
+                if onto.startswith( prefix ):
+                    onto	= onto[len( prefix ):]
+                edges.append( ( e, ( n, onto, p ), ( onto, n, p )))
+            self.edges.append( edges )
+        self.results		= [ {} for _ in self.sites ]	# each site's last step's results
+        index			= self.net.index
+        self.world		= index['world']
+        self.ground		= index['ground']
+        self.water		= [ ( l, index[st.name + '/' + l.zone] )
+                                    for st in self.sites for l in st.boiler.loops ]
+        self.nodes		= [ ( st.spaces[n].conditions, index[st.name + '/' + n] )
+                                    for st in self.sites for n in st.spaces if n not in ( 'world', 'ground' ) ]
+        logging.info( "Campus of %d sites: %d nodes, %d edges, %d partitions" % (
+            count, len( self.net.names ), len( self.net.UA ), len( self.net.partition() )))
+
+    def step( self, now, delta, outdoor = None, soil = None, tolerance = None ):
+        # Step every site from now - delta to now.  If an error tolerance (F) is given, the step may
+        # be shortened to keep within it.  Returns the step taken, and the step suggested next; each
+        # site's results are in self.results.
+        T, Q			= self.net.T, self.net.Q
+        if outdoor is not None:
+            T[self.world]	= outdoor
+        if soil is not None:
+            T[self.ground]	= soil
+        for st in self.sites:
+            supply( st, delta )
+        for l,i in self.water:
+            Q[i]		= l.output
+        if tolerance is None:
+            self.net.step( delta )
+            taken, suggest	= delta, delta
+        else:
+            taken, _, suggest	= self.net.adapt( delta, tolerance )
+        now			= now - delta + taken
+        for cond,i in self.nodes:
+            cond.temperature	= T[i]
+
+        # Account each site's heat flows (at the step's final temperatures, as for backward Euler).
+        # The network stands in for each site's world.compute, so advance its spaces' time too.
+        flows			= self.net.flows()
+        h			= taken / 60 / 60
+        for n,st in enumerate( self.sites ):
+            for sp in st.spaces.values():
+                sp.now		= now
+            results		= {}
+            for e,k,r in self.edges[n]:
+                btu		= flows[e] * h
+                results[k]	= btu
+                results[r]	= -btu
+            results.update( ( (l.zone,'hydronic','pumps'), l.output * h ) for l in st.boiler.loops )
+            if st.energy is None:
+                st.energy	= ledger( results.keys(), energy_groups )
+            st.energy.add( results, now )
+            self.results[n]	= results
+            sense( st, now )
+        self.refresh()
+        for st in self.sites:
+            control( st, now )
+        return taken, suggest
+
+    def refresh( self ):
+        # Reload the network's temperatures from the sites' spaces (eg. after restoring a checkpoint)
+        for cond,i in self.nodes:
+            self.net.T[i]	= cond.temperature
+
+
+#
+# derive -- compute a site's space's derived (display) state from a step's results
+#
+#     Sums up all the BTU gain/loss by the space from/to other spaces via each portal.  Remember them
+# in the site's frame (see frame.py), so we can return them on demand via the web JSON API.  The
+# area weighted average radiant temperature of every space (for Fanger's equation) is computed once
+# per step.  Remembers the space's Fanger comfort (PMV, feels, clo, clothing, met, metabolism) in the
+# frame's slots.  The space's fanger arguments are kept (and refreshed in place) in a frame slot,
+# but a new fanger is created each step, as it may derive values from its temperatures when
+# constructed.  Returns the space's total BTU gain/loss over the step.
+#
+def derive( site, s, results, delta ):
+    spaces, fang		= site.spaces, site.fang
+    frm				= site.frame
+    if frm is None:
+        frm = site.frame	= frame( spaces, results.keys() )
+    frm.track( results, spaces )
+    frm.radiate( results, spaces )
+    i				= frm.index[s]
+    btu				= 0.
+    inside			= spaces[s].conditions
+    for j in frm.space_portals[i]:
+        val			= results.get( frm.portals[j], 0. )
+        btu            += val
+        frm.portal_btu_h[j]	= val * 60*60 / delta
+
+
+    kwds			= frm.space_kwds[i]
+    own				= fang.get( s ) or fang['']
+    for k in itertools.chain( fang[''], own ):
+        kwds[k]			= own.get( k, fang[''].get( k ))
+    t_r				= F_to_C( frm.space_radiant[i] )
+    t_a				= F_to_C( inside.temperature )
+    try:
+        f			= fanger( hum=0.5, t_r=t_r, t_a=t_a, **kwds )
+        pmw			= f.L()
+        feels			= f.feels()
+        _, clo, clostr		= f.clothing()
+        _, met, metstr		= f.metabolism()
+    except Exception as exc:
+        pmw			= 0.0
+        feels			= "unknown"
+        clo, clostr		= math.nan, "unknown"
+        met, metstr		= math.nan, "unknown"
+        logging.warning( "Fanger failure: args: %r, t_r=%r, t_a=%r; %s", kwds, t_r, t_a,
+                         exc if not logging.getLogger().isEnabledFor( logging.INFO ) else traceback.format_exc() )
+        #raise
+    frm.space_pmv[i], frm.space_clo[i], frm.space_met[i] = pmw, clo, met
+    frm.space_feels[i], frm.space_clothing[i], frm.space_metabolism[i] = feels, clostr, metstr
+    frm.space_valid[i]		= 1
+    return btu
+
+
+#
+# state -- a site's current model state, for the web JSON API
+#
+#     Temperatures are in C, loads in BTU/h.  The derived state (spaces' load, radiant temperature
+# and comfort) must already have been computed by derive, for the spaces in size, world and ground.
+#
+def state( site, now ):
+    spaces, cntrl, boiler	= site.spaces, site.cntrl, site.boiler
+    world			= site.world
+    result			= dict(
+        time		= now,
+        elapsed		= world.now - world.start,
+        plant		= dict( output=boiler.output, input=boiler.input ),
+        spaces		= {},
+        zones		= {},
+    )
+    frm				= site.frame
+    for s in spaces.keys():
+        sp			= spaces[s]
+        ss			= result['spaces'][s] = dict(
+            temperature	= F_to_C( sp.conditions.temperature ),
+            sensor	= bool( sp.conditions.sensor ),
+        )
+        if s in size:
+            ss['setpoint']	= F_to_C( site.temp.get( s, site.temp[''] ))
+        if frm is not None and frm.valid.get( s ):
+            ss['radiant']	= F_to_C( frm.radiant[s] )
+            ss['pmv']		= frm.pmv[s]
+            ss['feels']		= frm.feels[s]
+            ss['load']		= dict( frm.loads( s ))
+    for l in boiler.loops:
+        z			= l.zone
+        c			= cntrl[z][1]
+        result['zones'][z]	= dict(
+            space	= cntrl[z][0],
+            heatcall	= heatcall( site, z ),
+            P		= c.P,
+            I		= c.I,
+            D		= c.D,
+            Kpid	= [ c.Kp, c.Ki, c.Kd ],
+            Lout	= list( c.Lout ),
+            output	= l.output,
+            supply	= F_to_C( boiler.supply ),
+            ret		= F_to_C( l.ret ),
+        )
+    if site.residual.probes:
+        result['residual']	= site.residual.state()
+    return result
+
+
+#
+# publish -- publish a site's state via the web JSON API (if serving) once per step
+#
+#     Any spaces not already 'derived' for this step are derived first, also if exporting metrics
+# (which are then updated once per step, for every site; see metrics.exporter.update).
+#
+def publish( site, now, results, delta, derived = () ):
+    if site.web is None and site.metrics is None:
+        return
+    for s in itertools.chain( [ 'world', 'ground' ], size.keys() ):
+        if s not in derived:
+            derive( site, s, results, delta )
+    if site.web:
+        site.web.publish( state( site, now ))
+
 
 #
 # Curses-based Textual UI.
@@ -392,6 +853,115 @@ def pansiz( rows, cols ):
 def panloc( c, rows, cols ):
     return rows//15, ( c < cols//2 ) and ( cols//2 + cols//10 ) or ( 0 + cols//10 )
 
+#
+# layout -- the arrangement of the UI's spaces into pages of screen cells
+#
+#     The (sorted) order of the included spaces, and each space's zone (and whether it is its zone's
+# primary, PID controlled space) are computed once, when the model's spaces are laid out.  The screen
+# geometry of each page's cells (and the temperature scale labels for each rank of cells) is computed
+# once per screen resize.  Each frame then simply looks them up.
+#
+#     Only as many spaces as fit on the screen (in cells at least 'minwidth' x 'minheight') are shown;
+# the view pages through the (optionally zone filtered) spaces, showing the page containing the
+# selected space.  Only the visible spaces' state need be computed for each frame.
+#
+class layout( object ):
+    topmargin			= 2
+    botmargin			= 9
+    minwidth			= 15
+    minheight			= 10
+
+    def __init__( self, include, zone ):
+        self.zone		= {}		# { space: zone, ... }
+        self.primary		= {}		# { space: zone, ... }, if space is zone's primary
+        self.order		= {}		# { space: position in zone, ... }
+        for z,l in zone.items():
+            for i,s in enumerate( l ):
+                self.zone[s]	= z
+                self.order[s]	= i
+            self.primary[l[0]]	= z
+        # Sort by zone, and by position within the zone; spaces not in any zone go last, by name.
+        self.spaces		= sorted( include, key=lambda s: (
+            ( 0, self.zone[s], self.order[s] ) if s in self.zone else ( 1, s, 0 )))
+        self.zones		= sorted( zone.keys(), key=misc.natural )
+        self.rows, self.cols	= None, None
+        self.fits		= False
+        self.select( None )
+
+    def select( self, zone ):
+        # Show only the spaces of the given zone (or all, if None); any cell geometry is recomputed.
+        self.filter		= zone
+        self.include		= [ s for s in self.spaces if zone is None or self.zone.get( s ) == zone ]
+        self.rows, self.cols	= None, None
+
+    def cycle( self ):
+        # Select the next zone filter; all, then each zone in turn.
+        n			= ( [ None ] + self.zones ).index( self.filter ) + 1
+        self.select( ( [ None ] + self.zones )[n % ( len( self.zones ) + 1 )] )
+
+    def resize( self, rows, cols ):
+        # Compute the screen geometry, if changed.  We want cells about 3 times as high as wide, and
+        # at least 'minwidth' characters wide.  Keep piling 'til we are either over that wide, or
+        # less than 3 times as high as wide (or each rank holds just one cell; piling no higher can
+        # widen them).  Only as many spaces as fit are shown on each page.  Returns False if the
+        # screen is too small for even one cell.
+        if ( rows, cols ) == ( self.rows, self.cols ):
+            return self.fits
+        self.rows, self.cols	= rows, cols
+        capacity		= max( 0, ( rows - self.topmargin ) // self.minheight ) \
+                                  * max( 0, cols // self.minwidth - 1 )
+        areas			= max( 1, min( len( self.include ), capacity ))
+        while True:
+            pile		= 1
+            rank		= areas // pile
+            height		= rows - self.topmargin
+            width		= cols // ( rank + 1 )
+            while pile < areas and ( width < self.minwidth or height >= 5 * width / 4 ):
+                pile	       += 1
+                rank		= ( areas + pile - 1 ) // pile	# ensure integer div rounds up
+                height		= ( rows - self.topmargin ) // pile
+                width		= cols // ( rank + 1 )
+            if height >= self.minheight or areas == 1:
+                break
+            areas	       -= 1
+        self.pile, self.rank	= pile, rank
+        self.width, self.height	= width, height
+        self.count		= areas		# spaces per page
+        self.fits		= height >= self.minheight and width >= self.minwidth
+        if not self.fits:
+            return False
+
+        # Each rank's bottom row, its temperature rows (an inverted domain->range mapping), and the
+        # labels for each row of its temperature scale.
+        self.ranks		= []
+        for p in range( 0, pile ):
+            r			= rows - p * height
+            Rtemprows		= ( r - self.botmargin + 1, r - height + 1 )
+            labels		= []
+            for rt in range ( Rtemprows[1], Rtemprows[0] ):
+                rtemp		= misc.scale( rt, Rtemprows, interval['fahrenheit'] )
+                labels.append( ( rt, "% 7.2F (% 7.2fC)" % ( rtemp, F_to_C( rtemp ))))
+            self.ranks.append( ( r, Rtemprows, labels ))
+
+        # Each page position's cell ( p, c, r, Rtemprows ); its rank, column, bottom row and
+        # temperature rows
+        self.cells		= []
+        for a in range( areas ):
+            p			= pile - a // rank - 1
+            c			= width + width * ( a % rank )
+            self.cells.append( ( p, c ) + self.ranks[p][:2] )
+        return True
+
+    def page( self, selected ):
+        # The range of (filtered) include indices on the page containing the selected index.
+        first			= selected // self.count * self.count
+        return range( first, min( first + self.count, len( self.include )))
+
+    def cell( self, a ):
+        # The cell of the given (filtered) include index, on its page.
+        return self.cells[a % self.count]
+
+
 def ui( win, cnf ):
 
     global now
@@ -401,39 +971,17 @@ def ui( win, cnf ):
 
     rows, cols			= 0, 0
 
-    # Include every space defined (by size), plus the world (air) and ground
-    # Sort include by zone.
-    include			= [ 'world', 'ground' ]
-    include                    += size.keys()
-
-    def by_zone( sl, sr ):
-        zl		= None
-        zr		= None
-        for z,l in zone.items():
-            for s in l:
-                if s == sl:
-                    zl	= z
-                if s == sr:
-                    zr	= z
-            if zl and zl == zr:
-                return l.index(sl) - l.index(sr)			# Both in same zone!  Sort by position
-        if zl is None:
-            if zr is None:
-                return sl < sr and -1 or ( sl > sr and 1 or 0 )		# Neither in zone; sort by name
-            else:
-                return 1						# Otherwise, None is always after anything
-        elif zr is None:
-            return -1							# Anything is always before None
-        return zl < zr and -1 or ( zl > zr and 1 or 0 )			# Generally, sort by zone
+    # Include every space defined (by size), plus the world (air) and ground, sorted by zone.
+    lay				= layout( itertools.chain( [ 'world', 'ground' ], size.keys() ), zone )
 
     logging.info("threads: %2d: %s" % (
             threading.active_count(),
             ', '.join( [ t.name for t in threading.enumerate() ] )))
 
-    include.sort( key = functools.cmp_to_key( by_zone ))
     input		= 0
     delta		= 0.0
     while not cnf['stop']:
+        include		= lay.include
         message( win, "%s (%7.3f): (%3d == '%c') Quit [qy/n]?, Temperature:% 6.1fC (% 6.1fF) [T/t]"
                  % (  daytime( world.now - world.start ), delta,
                       input, curses.ascii.isprint( input ) and chr( input ) or '?',
@@ -441,11 +989,7 @@ def ui( win, cnf ):
                  row = 0, clear = False )
 
         # See if we can deduce which (if any) zone PID controller is selected.  
-        controllable	= ''
-        for z,l in zone.items():
-            if include[selected] in l:
-                # selected space is in zone's list!  Use default (first) space name
-                controllable = z
+        controllable	= lay.zone.get( include[selected], '' )
         if controllable:
             message( win, "%-10s (%-10s) PID: K: [P/p]% 12.6f [I/i]% 12.6f [D/d]% 12.6f, Limit: [L/l]:% 12.6f" % (
                 controllable, cntrl[controllable][0],
@@ -543,6 +1087,21 @@ def ui( win, cnf ):
         if input in ( curses.ascii.ACK, curses.KEY_RIGHT, 261 ):# ^f, -->
             selected		= ( selected + 1 ) % len( include )
 
+        # Page through the spaces, or filter them by zone; the page containing the selected space
+        # is displayed.
+        if input in ( curses.KEY_PPAGE, 339 ) and lay.fits:	# PgUp
+            selected		= max( 0, selected - lay.count )
+        if input in ( curses.KEY_NPAGE, 338 ) and lay.fits:	# PgDn
+            selected		= min( len( include ) - 1, selected + lay.count )
+        if input in ( curses.KEY_HOME, 262 ):
+            selected		= 0
+        if input in ( curses.KEY_END, 360 ):
+            selected		= len( include ) - 1
+        if 0 < input <= 255 and chr( input ) == 'z':
+            lay.cycle()
+            include		= lay.include
+            selected		= 0
+
         if input in ( curses.ascii.DLE, curses.KEY_UP, 259 ):	# ^p, ^
             if include[selected] == 'world':                    #     |
                 world.conditions.temperature += 1.801/2
@@ -592,103 +1151,31 @@ def ui( win, cnf ):
         last			= real
         now                     = real
 
-        # Compute the heat gain/loss for each zone over the last time period.
-        results			= world.compute( now=now )
-
-        # For "simulated" zones (with no temperature sensors in their slab##), add in the heat added
-        # to each zone over the last time period.  This uses the *previous* time period's computed
-        # degree-minutes per hour computation for the zone.
-
-        # TODO: we'll work the PID loop in simple BTU/hour for now...  So, the computed
-        # BTU/hour is scaled by the delta (in seconds) elapsed during the last time period.
-        # Fake up a key to represent heat added to the zone## water by the pumps.
-
-        adjusted		= copy.copy( results )
-        for z in cntrl.keys():
-            s			= z.replace( 'zone', 'slab' )
-            if s in spaces:
-                # Zone with slab sensor.  
-                sen		= spaces[s].conditions.sensor
-                if sen:
-                    with sen.lock:
-                        act	= sen.compute( max( now, sen.now ))
-                    if not misc.non_value( act ) and 0.0 < act < 40.0:
-                        cur	= C_to_F( act )
-                        spaces[s].conditions.temperature \
-                                = spaces[z].conditions.temperature \
-                                = cur
-                        continue
-         
-                    logging.debug( "%s == %s: Invalid sensor; ignoring" % ( s, str( act )))
-
-            # zone has no slab sensor, or a broken slab sensor; use the zone's
-            # primary aliases' current temperature.
-            alias		= zone[z][0]
-            spaces[s].conditions.temperature \
-                = spaces[z].conditions.temperature \
-                = spaces[alias].conditions.temperature
-
-            '''
-            # Used to try to compute how much heat we added, in BTU/hr, but we
-            # didn't have the supply/return temps or flow rates; could do a
-            # similar computation but would have to run the PID loop on
-            # degree-minutes per hour, which we can compute, and would be a
-            # consistent measure of energy over time for each zone.
-            k			= ( z, 'hydronic', 'pumps' )
-            if k not in adjusted:
-                adjusted[k]	= 0.
-            adjusted[k]        += misc.scale( cntrl[z][1].value,
-                                              interval['normal'], interval['BTU'] ) * delta / 60 / 60
-            '''
-
-
-        # And finally, apply the net BTU gains/losses to the world.  This estimates the temperature
-        # conditions of every space and surface in the world.
-        world.absorb( adjusted )
+        # Compute the heat gain/loss for each zone over the last time period, add the plant's heat,
+        # and run the PID loops.
+        begun			= misc.timer()
+        results			= step( site, now, delta )
+        latency			= misc.timer() - begun
+        if cnf.get( 'checkpoint' ) and cnf['checkpoint'].due( now ):
+            cnf['checkpoint'].save( now )
 
 
         # Next frame of animation
         win.erase()
 
-        # Reserve a top margin for screen, and a bottom margin for each rank in the pile
-        templo                  = -40
-        temphi                  = +120
-        temprange		= temphi - templo
-
-        topmargin               = 2
-        botmargin               = 9
-        botrow			= rows - botmargin
-
-        # Compute screen size and display headers.  We want cells about 3 times as high as wide, and
-        # at least 20 characters wide.  Keep piling 'til we are either over 20 characters wide, or
-        # less than 3 times as high as wide.
-        try:
-            areas		= len( include )
-            pile		= 1
-            rank		= areas // pile
-            height		= rows - topmargin
-            width		= cols // ( rank + 1 )
-            while width < 15 or height >= 5 * width / 4:
-                pile           += 1
-                rank		= ( areas + pile - 1 ) // pile	# ensure integer div rounds up
-                height		= ( rows - topmargin ) // pile
-                width		= cols // ( rank + 1 )
-            if height < 10:
-                raise
-        except:
-            message( win, "Insufficient screen size (%d areas, %d ranks of %dx%d); increase height/width, or reduce font size" % (
-                areas, pile, width, height ),
+        # Compute screen size (if changed) and display headers, reserving a top margin for screen,
+        # and a bottom margin for each rank in the pile.
+        if not lay.resize( rows, cols ):
+            message( win, "Insufficient screen size (%dx%d) for even one %dx%d area; increase height/width, or reduce font size" % (
+                cols, rows, 2 * lay.minwidth, lay.topmargin + lay.minheight ),
                      col = 0, row = 0 )
+            win.refresh()
             time.sleep( 2 )
             continue
+        pile, rank		= lay.pile, lay.rank
+        width, height		= lay.width, lay.height
 
-
-        # Compute the range of rows used to span the entire temperature range
-        rowrange		= height - botmargin
-
-        for p in range( 0, pile ):
-            r			= rows - p * height
-
+        for r,Rtemprows,labels in lay.ranks:
             message( win, "zone (volume):",         col = 0, row = r - 9 )
             message( win, "zone/slab/floor (C):",   col = 0, row = r - 8 )
             message( win, "Heat Call/Load:",        col = 0, row = r - 7 )
@@ -698,125 +1185,51 @@ def ui( win, cnf ):
             message( win, "Air/Rad.(C), Comfort:",  col = 0, row = r - 3 )
             message( win, "BTU/h Load:",            col = 0, row = r - 2 )
             message( win, "Space:",                 col = 0, row = r - 1 )
+            for rt,label in labels:
+                message( win, label, col = 0, row = rt, clear = False )
 
-            Rtemprows		= ( r - botmargin + 1, r - height + 1 ) # Inverted domain->range mapping
-            for rt in range ( Rtemprows[1], Rtemprows[0] ):
-                rtemp		= misc.scale( rt, Rtemprows, interval['fahrenheit'] )
-                message( win, "% 7.2F (% 7.2fC)" % ( rtemp, F_to_C( rtemp )),
-                         col = 0, row = rt, clear = False )
-
-        def space_pos( a, n ):
-            p			= pile - a // rank - 1
-            c			= width + width * ( a % rank )
-            r			= rows - p * height
-            return (p,c,r)
-
-        for a in range( 0, len( include )):
+        # Only the spaces on the selected space's page are derived and displayed
+        page			= lay.page( selected )
+        for a in page:
             s			= include[a]
 
-            # Sum up all the BTU gain/loss by the space from/to other spaces via
-            # each portal.  Remember them in spaces[<name>].load, so we can
-            # return them on demand via the web JSON API.  Compute the btu/h,
-            # ft^2 and radiant temperature of each portal, and compute the total
-            # average radiant temperature for Fanger's equation.
-            btu			= 0.
-            btudct		= {}
-            area		= 0.
-            radiant		= 0.
-            inside		= spaces[s].conditions
-            for rs,ro,rp in results.keys():
-                if rs != s:
-                    continue
-                val		= results[(rs,ro,rp)]
-                btu            += val
-                btu_h		= val * 60*60 / delta
-                outside		= spaces[ro].conditions
-                portal		= None
-                for p in spaces[rs].portals:
-                    if ro == p.onto and rp == p.name:
-                        # This space 'rs' has a portal onto other space 'ro'
-                        # Compute portal's inside temperature facing us
-                        portal	= p
-                        break
-                if portal is None:
-                    for p in spaces[ro].portals:
-                        if rs == p.onto and rp == p.name:
-                            # Other space 'ro' has a portal onto this space 'rs'
-                            # Compute portal's outside temperature facing us
-                            portal = p
-                            break;
-
-                if portal is None:
-                    logging.info( "Couldn't find portal named %s" % ( rp ))
-                pt      	= portal.temperature( inside=inside, outside=outside )
-                pa      	= portal.area()
-                area           += pa
-                radiant        += pa * pt
-                btudct[(rs,ro,rp)] = (btu_h, pa, F_to_C( pt ),
-                                      F_to_C( inside.temperature ),
-                                      F_to_C( outside.temperature ),
-                                      portal.R)
-
-            spaces[s].load	= btudct
-            spaces[s].radiant	= radiant/area if area > 0 else inside.temperature
+            # Sum up all the BTU gain/loss by the space, and its comfort
+            btu			= derive( site, s, results, delta )
+            frm			= site.frame
 
-
-            kwds		= copy.copy( fang[''] )
-            if s in fang:
-                kwds.update( fang[s] )
-            kwds["hum"]		= 0.5
-            kwds["t_r"]		= F_to_C( spaces[s].radiant )
-            kwds["t_a"]		= F_to_C( inside.temperature )
-            try:
-                spaces[s].fanger= fanger( **kwds )
-                pmw             = spaces[s].fanger.L()
-                feels		= spaces[s].fanger.feels()
-                _, clo, clostr	= spaces[s].fanger.clothing()
-                _, met, metstr	= spaces[s].fanger.metabolism()
-            except Exception as exc:
-                pmw		= 0.0
-                feels		= "unknown"
-                clo, clostr	= math.nan, "unknown"
-                met, metstr	= math.nan, "unknown"
-                logging.warning( "Fanger failure: args: %r; %s", kwds,
-                                 exc if not logging.getLogger().isEnabledFor( logging.INFO ) else traceback.format_exc() )
-                #raise
-
-            p,c,r		= space_pos( a, len( include ))
+            p,c,r,Rtemprows	= lay.cell( a )
 
             # Find the controls for this zone "<z> #".
-            for z,l in zone.items():
-                if s in l:
-                    # This space's temperature is controlled by this zone's
-                    # heated floor sandwich:
-                    #
-                    # <space>    <space>    <space>     Spaces...
-                    #
-                    # <space> #  <space> #  <space> #   Floors...
-                    # -------------------------------
-                    #               slab #              Slab
-                    # -------------------------------
-                    #               zone #              Zone  (fluid)
-                    fl 		= z.replace( 'zone', s )
-                    sl		= z.replace( 'zone', 'slab' )
-                    message( win, "|%c%5.1f%c%5.1f%c%5.1f" % (
-                        '*' if spaces[z].conditions.sensor else ' ',
-                        F_to_C( spaces[z].conditions.temperature ),
-                        '*' if spaces[sl].conditions.sensor else '/',
-                        F_to_C( spaces[sl].conditions.temperature ),
-                        '*' if spaces[fl].conditions.sensor else '/',
-                        F_to_C( spaces[fl].conditions.temperature )),
-                             col = c, row = r - 8 )
-
-                if s == l[0]:
+            z			= lay.zone.get( s )
+            if z:
+                # This space's temperature is controlled by this zone's
+                # heated floor sandwich:
+                #
+                # <space>    <space>    <space>     Spaces...
+                #
+                # <space> #  <space> #  <space> #   Floors...
+                # -------------------------------
+                #               slab #              Slab
+                # -------------------------------
+                #               zone #              Zone  (fluid)
+                fl 		= z.replace( 'zone', s )
+                sl		= z.replace( 'zone', 'slab' )
+                message( win, "|%c%5.1f%c%5.1f%c%5.1f" % (
+                    '*' if spaces[z].conditions.sensor else ' ',
+                    F_to_C( spaces[z].conditions.temperature ),
+                    '*' if spaces[sl].conditions.sensor else '/',
+                    F_to_C( spaces[sl].conditions.temperature ),
+                    '*' if spaces[fl].conditions.sensor else '/',
+                    F_to_C( spaces[fl].conditions.temperature )),
+                         col = c, row = r - 8 )
+
+                if lay.primary.get( s ) == z:
                     # Display PID loop data only in first (primary) space above zone
-                    spaces[s].heatcall	= misc.scale( cntrl[z][1].value,
-                                                      interval['normal'],
-                                                      interval['percent'] ) # was 'BTU'
+                    frm.space_heatcall[frm.index[s]] = heatcall( site, z )
                     try:
                         Pp,Pi,Pd	= cntrl[z][1].contribution()
 
-                        message( win, "| %7.3f%%/%9.3f" % ( spaces[s].heatcall, btu *60*60/delta ),
+                        message( win, "| %7.3f%%/%9.3f" % ( frm.heatcall[s], btu *60*60/delta ),
                                  col = c, row = r - 7 )
                         message( win, "|% 13.8f % 4d%%" % ( cntrl[z][1].P, Pp * 100 ),
                                  col = c, row = r - 6 )
@@ -827,40 +1240,27 @@ def ui( win, cnf ):
                     except:
                         message( win, "%s?" % ( z ), col = c, row = r - 9 )
 
-            message( win, "|" + s + " %3.1f/%s" % ( clo, clostr ) + " %3.1f/%s" % ( met, metstr ),
+            message( win, "|" + s + " %3.1f/%s" % ( frm.clo[s], frm.clothing[s] ) + " %3.1f/%s" % ( frm.met[s], frm.metabolism[s] ),
                      col = c, row = r - 1 )
 
-            # Current and target temperature.  If a space has a sensor, we'll update the current
-            # conditions temperature from the sensor (using the value's current time, 'cause it is
-            # being updated in the background, and may have a time already after our own 'now' cycle
-            # time), and display the error in +/- degrees/hour between the computed temperature
-            # (from heat gain/loss from all adjoining spaces), and the measurement.  This will give
-            # us some idea of the error in our thermodynamic model...
+            # Current and target temperature.  If a space has a sensor, step has already updated
+            # the current conditions temperature from it.
             t			= temp['']
             if s in temp:
                 t		= temp[s]
             if s == include[selected]:
                 win.attron(curses.A_REVERSE);
 
-            Rtemprows		= ( r - botmargin + 1, r - height + 1 ) # Inverted domain->range mapping
             if s in size.keys():
                 message( win, "% 6.1fC>" % ( F_to_C( t )),
                          col = c, row = misc.clamp( misc.scale( t, interval['fahrenheit'], Rtemprows ),
                                                     ( Rtemprows[1], Rtemprows[0] )))
             cur			= spaces[s].conditions.temperature
-            sen			= spaces[s].conditions.sensor
-            if sen:
-                with sen.lock:
-                    act		= sen.compute( max( now, sen.now ))
-                if not misc.non_value( act ):
-                    cur		= C_to_F( act )
-                    spaces[s].conditions.temperature \
-                                = cur
 
             # Current (averaged over several minutes, if sensor available), or computed
             message( win, "|%4.1f/%4.1fC %3.1f/%s" % (
                 F_to_C( spaces[s].conditions.temperature ),
-                F_to_C( spaces[s].radiant ), pmw, feels ),
+                F_to_C( frm.radiant[s] ), frm.pmv[s], frm.feels[s] ),
                      col = c, row = r - 3 )
 
             # Current temperature, and automation mode
@@ -875,34 +1275,28 @@ def ui( win, cnf ):
             if s == include[selected]:
                 win.attroff(curses.A_REVERSE);
 
-        # Run the PID controllers for this time period, to compute next time period's
-        # BTU/hour contributions.  Condition the input and output to be in range (0,1)
-
-        for z in cntrl.keys():
-            try:    t           = temp[cntrl[z][0]]
-            except: t		= temp['']
-            cntrl[z][1].loop(
-                setpoint	= misc.scale( t,
-                                              interval['fahrenheit'], interval['normal'] ),
-                process		= misc.scale( spaces[cntrl[z][0]].conditions.temperature,
-                                              interval['fahrenheit'], interval['normal'] ),
-                now		= now )
+        # The displayed spaces' state is already derived; publish it (and the rest) for the web JSON API
+        publish( site, now, results, delta, derived=[ include[a] for a in page ] )
+        if cnf.get( 'metrics' ):
+            cnf['metrics'].update( now, misc.timer(), latency )
 
         # Make h- and v-bars, everwhere except top margin
-        for r in range( topmargin, rows ):
+        for r in range( lay.topmargin, rows ):
             if ( rows - r ) % height == 0:
                 win.hline( r, 0, curses.ACS_HLINE, cols )
         for c in range( width, cols, width):
-            win.vline( topmargin, c, curses.ACS_VLINE, rows - topmargin )
+            win.vline( lay.topmargin, c, curses.ACS_VLINE, rows - lay.topmargin )
 
-        message( win, "%2d areas on %3dx%3d screen ==> %3d x %2d/rank @ %2dx%2d" % (
-                    areas, cols, rows, pile, rank, width, height ),
+        message( win, "%2d-%2d of %2d %-8s [z]%-9s %3dx%3d ==> %2dx%2d @ %2dx%2d" % (
+                    page[0] + 1 if page else 0, page[-1] + 1 if page else 0, len( include ),
+                    lay.filter or "(all)", "[PgUp/Dn]" if len( page ) < len( include ) else "",
+                    cols, rows, pile, rank, width, height ),
                  col = cols - 60, row = 0, clear = False )
 
         # Itemize the gain/loss details for all portals in the selected area.  Sort all of the
         # selected space's gain/loss by area.  Move 'winsel's curses.panel 'pansel' clear of its
         # detail's location...  If window is resized, this may fail; if so, loop and recompute..
-        p,c,r			= space_pos( selected, len( include ))
+        p,c,r,_			= lay.cell( selected )
         try:
             pansel.move( * panloc( c, rows, cols ))
         except:
@@ -919,15 +1313,15 @@ def ui( win, cnf ):
 
         # Get selected keys, sorted by absolute gain/loss
         sel			= sorted(
-                                    [ k for k in adjusted.keys()
+                                    [ k for k in results.keys()
                                         if k[0] == include[selected] ],
-                                    key=lambda x: abs(adjusted.__getitem__(x)), reverse=True)
+                                    key=lambda x: abs(results.__getitem__(x)), reverse=True)
 
         btu			= 0.
         for s,o,p in sel:
             #message( winsel, "%s %s %s" % ( s, o, p ), col=2, row=r )
             #r                 += 1
-            b                   = adjusted[(s,o,p)] * 60 * 60 / delta
+            b                   = results[(s,o,p)] * 60 * 60 / delta
             btu                += b
             # Search the entire world, find the portal, by name, and get its area and R value
             for space, depth in world.walk():
@@ -1018,13 +1412,235 @@ def txtgui( cnf ):
     return False
 
 
+#
+# Headless (non-curses) simulation.  Advances simulated time by cnf['step'] seconds per model step as
+# fast as possible (or, if cnf['speed'] is non-zero, at that multiple of real time), until
+# cnf['duration'] simulated seconds have elapsed (forever, if None).  Logs a summary each hour.  If
+# cnf['campus'] is supplied, steps all of its sites instead (incl. the default site, as its first),
+# using the default site's world and ground temperatures as their weather, and publishes each.  If
+# cnf['adaptive'] is also supplied, each campus step is shortened as necessary to keep its estimated
+# error (F) within that tolerance; starting from cnf['step'] seconds, steps may grow (while well
+# within tolerance) up to cnf['largest'] seconds.
+#
+def headless( cnf ):
+    global now
+    start			= now
+    report			= now
+    real			= misc.timer()
+    delta			= cnf['step']
+    steps			= 0
+    while not cnf['stop']:
+        if cnf['duration'] is not None and now - start >= cnf['duration']:
+            break
+        steps		       += 1
+        if cnf['campus']:
+            begun		= misc.timer()
+            taken, suggest	= cnf['campus'].step( now + delta, delta, outdoor=world.conditions.temperature,
+                                                      soil=ground.conditions.temperature,
+                                                      tolerance=cnf.get( 'adaptive' ))
+            now		       += taken
+            delta		= min( cnf['largest'], suggest )
+            latency		= misc.timer() - begun
+            for st,results in zip( cnf['campus'].sites, cnf['campus'].results ):
+                publish( st, now, results, taken )
+        else:
+            now		       += cnf['step']
+            begun		= misc.timer()
+            results		= step( site, now, cnf['step'] )
+            latency		= misc.timer() - begun
+            publish( site, now, results, cnf['step'] )
+        if cnf['metrics']:
+            cnf['metrics'].update( now, misc.timer(), latency )
+        if cnf['checkpoint'] and cnf['checkpoint'].due( now ):
+            cnf['checkpoint'].save( now )
+        if cnf['speed']:
+            time.sleep( max( 0., real + ( now - start ) / cnf['speed'] - misc.timer() ))
+        if now - report < 60 * 60:
+            continue
+        report			= now
+        if cnf['campus']:
+            sites		= cnf['campus'].sites
+            temps		= [ st.spaces[s].conditions.temperature for st in sites for s in size ]
+            logging.info( "%s: %d sites: plant % 12.1f BTU/h, spaces % 5.1fC - % 5.1fC, %4d steps" % (
+                daytime( now - start ), len( sites ), sum( st.boiler.output for st in sites ),
+                F_to_C( min( temps )), F_to_C( max( temps )), steps ))
+            steps		= 0
+        else:
+            logging.info( "%s: plant % 9.1f BTU/h: %s" % (
+                daytime( world.now - world.start ), boiler.output,
+                ', '.join( "%s % 5.1fC/% 5.1fC % 7.1f BTU/h" % (
+                    l.zone, F_to_C( spaces[cntrl[l.zone][0]].conditions.temperature ),
+                    F_to_C( spaces[l.zone].conditions.temperature ), l.output )
+                           for l in boiler.loops )))
+
+    # Summarize the energy gained/lost by each zone, and via each space's portals, over the run.  If
+    # the run outlasted the ledger's retained checkpoints, summarize since the oldest retained.
+    if site.energy is not None:
+        since			= start
+        if site.energy.dropped and site.energy.times[0] > start:
+            since		= site.energy.times[0]
+            logging.info( "Energy since %s (the oldest retained checkpoint), not the run's start" % (
+                daytime( since - start )))
+        portals, _, groups	= site.energy.between( since=since )
+        for z in sorted( groups ):
+            logging.info( "%-10s % 12.1f BTU" % ( z, groups[z] ))
+        for k in sorted( portals, key=lambda k: portals[k] ):
+            if k[0] in size:
+                logging.info( "%-10s % 12.1f BTU via %s" % ( k[0], portals[k], k[2] ))
+
+
 if __name__=='__main__':
 
     parser = optparse.OptionParser()
     parser.add_option( '-f', '--fake', dest='fake',
                        action="store_true", default=False,
                        help='Simulate sensors (default: False)')
+    parser.add_option( '-H', '--headless', dest='headless',
+                       action="store_true", default=False,
+                       help='Run the model without the curses UI (default: False)')
+    parser.add_option( '-s', '--step', dest='step',
+                       type="float", default=60.,
+                       help='Headless simulated seconds per model step (default: 60)')
+    parser.add_option( '-d', '--duration', dest='duration',
+                       type="float", default=None,
+                       help='Headless simulated seconds to run (default: forever)')
+    parser.add_option( '-w', '--web', dest='web',
+                       default=None,
+                       help='Serve the model state via HTTP/JSON at /api/state[/<site>] on [host]:port (default: None)')
+    parser.add_option( '-M', '--metrics', dest='metrics',
+                       default=None,
+                       help='Serve Prometheus metrics at /metrics on [host]:port (default: None)')
+    parser.add_option( '--metrics-file', dest='metrics_file',
+                       default=None,
+                       help='Periodically write Prometheus metrics to this file (default: None)')
+    parser.add_option( '-m', '--modbus', dest='modbus',
+                       default=None,
+                       help='Serve temperatures and heat calls via Modbus/TCP (unit id <site>) on [host]:port (default: None)')
+    parser.add_option( '-n', '--sites', dest='sites',
+                       type="int", default=0,
+                       help='Headless simulation of a campus of this many independent sites (default: 0)')
+    parser.add_option( '-b', '--building', dest='building',
+                       default=None,
+                       help='Apply a calibrated building file (see calibrate.py; fitted to the campus/adaptive RC network model) (default: None)')
+    parser.add_option( '-c', '--checkpoint', dest='checkpoint',
+                       default=None,
+                       help='Restore model and controller state from, and periodically save it to, this file (default: None)')
+    parser.add_option( '--checkpoint-interval', dest='checkpoint_interval',
+                       type="float", default=60. * 60,
+                       help='Seconds between checkpoints (default: 3600)')
+    parser.add_option( '-S', '--schedule', dest='schedule',
+                       action="store_true", default=False,
+                       help='Schedule setpoints by occupancy, with optimal start (default: False)')
+    parser.add_option( '-a', '--adaptive', dest='adaptive',
+                       type="float", default=None,
+                       help='Headless adaptive steps (from --step, up to --max-step seconds), within this error (C) (default: None)')
+    parser.add_option( '--max-step', dest='max_step',
+                       type="float", default=15. * 60,
+                       help='Largest headless adaptive step, in simulated seconds (default: 900)')
+    parser.add_option( '-j', '--jobs', dest='jobs',
+                       type="int", default=1,
+                       help='Step a campus in this many processes, or 0 for one per CPU (default: 1)')
+    parser.add_option( '--speed', dest='speed',
+                       type="float", default=0.,
+                       help='Headless multiple of real time, or 0 for as fast as possible (default: 0)')
     (options, args) = parser.parse_args()
 
-    txtcnf			= { 'stop': False }
-    txtgui( txtcnf )
+    # A calibrated building replaces the default site (built with the hand-estimated values)
+    if options.building:
+        calibrated( options.building )
+        site			= building( now )
+        world, ground, spaces	= site.world, site.ground, site.spaces
+        cntrl, boiler		= site.cntrl, site.boiler
+        temp, fang, auto	= site.temp, site.fang, site.auto
+
+    # A headless campus simulates the default site (with any interfaces), along with its other sites
+    txtcnf			= { 'stop': False, 'checkpoint': None, 'metrics': None }
+    sites			= [ site ]
+    if options.headless:
+        # Adaptive stepping solves the campus network; simulate the building as a campus of one
+        count			= options.sites or ( 1 if options.adaptive else 0 )
+        if count > 1:
+            site.name		= "site 1"
+        txtcnf.update( step=options.step, duration=options.duration, speed=options.speed,
+                       campus=campus( count, now, sites=sites ) if count else None,
+                       adaptive=options.adaptive * 9 / 5 if options.adaptive else None,
+                       largest=max( options.step, options.max_step ) if options.adaptive else options.step )
+        if txtcnf['campus']:
+            sites		= txtcnf['campus'].sites
+
+    # Each site's state is at /api/state/<n>; the default (first) site's also at /api/state
+    if options.web:
+        routes			= {}
+        for n,st in enumerate( sites ):
+            st.web		= webapi.snapshot()
+            routes['/api/state/%d' % ( n + 1 )] = st.web
+        routes['/api/state']	= site.web
+        webapi.serve( webapi.address( options.web, port=8080 ), routes )
+
+    # Every site's metrics are exported together, labelled by site, and updated once per step
+    if options.metrics or options.metrics_file:
+        txtcnf['metrics']	= metrics.exporter( sites, heatcall, comfort=size.keys(),
+                                                    path=options.metrics_file )
+        for st in sites:
+            st.metrics		= txtcnf['metrics']
+        if options.metrics:
+            webapi.serve( webapi.address( options.metrics, port=9100 ),
+                          { '/metrics': txtcnf['metrics'].snapshot } )
+
+    # Each campus site's registers are served as its own Modbus unit id (1-247); a lone site's, as any
+    if options.modbus:
+        units			= {}
+        for n,st in enumerate( sites[:247] ):
+            st.hil		= registers.image(
+                inputs	= itertools.chain( ( "%s temperature" % s for s in hil_spaces ),
+                                           ( "%s heat call" % z for z in hil_zones )),
+                holdings	= hil_zones )
+            units[n + 1]	= st.hil
+        if len( sites ) > len( units ):
+            logging.warning( "Modbus: only the first %d of %d sites are served" % (
+                len( units ), len( sites )))
+        registers.serve( webapi.address( options.modbus, port=502 ), units if len( sites ) > 1 else site.hil )
+
+    # Schedule the setpoints of the site (or campus sites) being simulated
+    if options.schedule:
+        for st in sites:
+            weeks		= {}
+            for s in size:
+                occ		= occupy.get( s, occupy[''] )
+                weeks[s]	= schedule.week( occ['hours'], occ['occupied'], occ['unoccupied'], holidays )
+            st.schedule		= schedule.planner( st, weeks )
+
+    # Warm-start from the last checkpoint (if any) of the site (or campus sites) being simulated.  A
+    # headless simulation also resumes the checkpoint's simulated time (the UI runs in real time).
+    if options.checkpoint:
+        txtcnf['checkpoint']	= checkpoint( options.checkpoint, sites,
+                                              interval=options.checkpoint_interval, groups=energy_groups )
+        try:
+            saved		= txtcnf['checkpoint'].restore()
+        except ValueError as exc:
+            logging.warning( "%s; cold-starting" % ( exc, ))
+            saved		= None
+        if saved is not None and options.headless:
+            now			= saved
+            for st in sites:
+                st.world.now	= now
+                for _,c in st.cntrl.values():
+                    c.now	= now
+        if saved is not None and txtcnf.get( 'campus' ):
+            txtcnf['campus'].refresh()
+
+    if options.headless:
+        if txtcnf['campus'] and options.jobs != 1:
+            logging.info( "Campus stepped in %d processes" % (
+                txtcnf['campus'].net.parallel( options.jobs or None ) or 1 ))
+        try:
+            headless( txtcnf )
+        except KeyboardInterrupt:
+            pass
+        if txtcnf['campus']:
+            txtcnf['campus'].net.close()
+    else:
+        txtgui( txtcnf )
+
+    if txtcnf['checkpoint']:
+        txtcnf['checkpoint'].save( now )
@@ -0,0 +1,103 @@
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+import logging
+import math
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+#
+# Lightweight embedded HTTP server, for serving the live model state to (many) dashboard clients.
+#
+#     The simulation loop publishes a new snapshot of its state once per step; it is serialized once
+# (into bytes), and the (body,etag) tuple reference is simply replaced.  Each request just sends the
+# most recently published body, so the serialization cost is per-step, not per-request; no lock is
+# held, so a slow client never blocks the simulation loop (nor other clients).  Clients may supply
+# If-None-Match: <etag> to receive a 304 Not Modified if no new step has been published since.
+#
+def finite( data ):
+    # A copy of the JSON-able data, with any non-finite float replaced by None
+    if isinstance( data, float ):
+        return None if math.isnan( data ) or math.isinf( data ) else data
+    if isinstance( data, dict ):
+        return dict( ( k, finite( v )) for k,v in data.items() )
+    if isinstance( data, ( list, tuple )):
+        return [ finite( v ) for v in data ]
+    return data
+
+
+class snapshot( object ):
+    def __init__( self, content_type = 'application/json' ):
+        self.content_type	= content_type
+        self.serial		= 0
+        self.current		= ( b'null', '"0"' )
+
+    def publish( self, data ):
+        # Serialize 'data' as JSON, and make it the current snapshot.  Non-finite numbers (eg. a
+        # failed PMV of NaN) aren't valid JSON; they are published as null.
+        self.update( json.dumps( finite( data ), sort_keys=True, allow_nan=False ).encode( 'utf-8' ))
+
+    def update( self, body ):
+        # Make the (already rendered) bytes the current snapshot.
+        self.serial	       += 1
+        self.current		= ( body, '"%d"' % self.serial )
+
+
+class handler( BaseHTTPRequestHandler ):
+    def do_GET( self ):
+        snap			= self.server.routes.get( self.path.split( '?', 1 )[0] )
+        if snap is None:
+            self.send_error( 404 )
+            return
+        body, etag		= snap.current
+        if self.headers.get( 'If-None-Match' ) == etag:
+            self.send_response( 304 )
+            self.send_header( 'ETag', etag )
+            self.end_headers()
+            return
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', snap.content_type )
+        self.send_header( 'Content-Length', str( len( body )))
+        self.send_header( 'Cache-Control', 'no-cache' )
+        self.send_header( 'ETag', etag )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, fmt, *args ):
+        logging.debug( "%s - %s" % ( self.address_string(), fmt % args ))
+
+
+class server( ThreadingMixIn, HTTPServer ):
+    daemon_threads		= True
+    allow_reuse_address		= True
+
+    def __init__( self, address, routes ):
+        HTTPServer.__init__( self, address, handler )
+        self.routes		= routes
+
+
+def address( spec, port = 80 ):
+    # Parse "[host][:port]" (or just "port") into a ( host, port ) address; host defaults to all
+    # interfaces.
+    if spec.isdigit():
+        spec			= ':' + spec
+    host, _, prt		= spec.rpartition( ':' ) if ':' in spec else ( spec, '', '' )
+    return ( host or '', int( prt ) if prt else port )
+
+
+def serve( addr, routes ):
+    # Start serving the { path: snapshot, ... } routes on addr in a background (daemon) thread.
+    srv				= server( addr, routes )
+    thr				= threading.Thread( target=srv.serve_forever, name="webapi %s:%d" % addr )
+    thr.daemon			= True
+    thr.start()
+    logging.info( "Serving %s on %s:%d" % ( ', '.join( sorted( routes )), addr[0] or '*', addr[1] ))
+    return srv